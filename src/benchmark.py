@@ -0,0 +1,412 @@
+'''
+Pathfinder benchmarks.
+
+Times the searches of pathfinder (and hpa), GridPath queries, the LRU
+cache of path tables of the per-query searches and the priority queues
+of A* (PriorityQueueSet and LazyPriorityQueueSet) over a matrix of
+grid sizes, obstacle densities and mazes, and writes the results as
+JSON, e.g.:
+
+    python benchmark.py --sizes 20x18,100x100 --output bench.json
+
+Each case runs in a fresh interpreter (unless --inline is given), so
+that the peak memory reported for it is its own.
+'''
+
+import argparse
+import json
+import platform
+import random
+import resource
+import subprocess
+import sys
+import time
+
+from timeit import default_timer
+
+from hpa import HierarchicalSearch
+from landmarks import LandmarkSearch
+from pathfinder import GridMap, GridPath, PathFinder, PriorityQueueSet, \
+                       LazyPriorityQueueSet, Node, SEARCH_BACKENDS
+
+SUITES = ('search', 'gridpath', 'cache', 'queue')
+
+# The priority queues, for the queue suite and the open set of the
+# 'pathfinder' backend
+QUEUES = {
+    'indexed': PriorityQueueSet,
+    'lazy': LazyPriorityQueueSet,
+}
+
+def create_map(rows, cols, maze, density, seed):
+    """ Create a rows X cols GridMap.
+
+        maze:
+            'random' to block each square with the probability
+            'density' (seeded with 'seed'), or 'serpentine' for the
+            worst case: walls across every other row, with a gap at
+            alternating ends, so that the path between the top and
+            the bottom visits about half of the squares.
+    """
+    gridmap = GridMap(rows, cols)
+    if maze == 'random':
+        rand = random.Random(seed)
+        for row in xrange(rows):
+            for col in xrange(cols):
+                if rand.random() < density:
+                    gridmap.set_blocked((row, col))
+    elif maze == 'serpentine':
+        for row in xrange(1, rows, 2):
+            gap = cols - 1 if row // 2 % 2 == 0 else 0
+            for col in xrange(cols):
+                if col != gap:
+                    gridmap.set_blocked((row, col))
+    else:
+        raise ValueError("unknown maze %r" % (maze,))
+    return gridmap
+
+def free_pairs(gridmap, count, seed):
+    """ 'count' seeded random (start, goal) pairs of free squares
+    """
+    rand = random.Random(seed)
+    free = [(row, col) for row in xrange(gridmap.rows)
+                       for col in xrange(gridmap.cols)
+                       if not gridmap.is_blocked((row, col))]
+    if not free:
+        return []
+    return [(rand.choice(free), rand.choice(free)) for i in xrange(count)]
+
+def create_search(name, gridmap, queue='indexed'):
+    """ Create the per-query search called 'name' on 'gridmap':
+        'pathfinder' for the generic PathFinder (with the open set
+        'queue', one of QUEUES), 'hpa', 'alt' (the LandmarkSearch),
+        or one of SEARCH_BACKENDS
+    """
+    if name == 'pathfinder':
+        return PathFinder(gridmap.successors, gridmap.move_cost,
+                          gridmap.move_cost, QUEUES[queue])
+    if name == 'hpa':
+        return HierarchicalSearch(gridmap)
+    if name == 'alt':
+        return LandmarkSearch(gridmap)
+    return SEARCH_BACKENDS[name](gridmap)
+
+def summarize(latencies):
+    """ The percentiles (nearest rank), mean and max of a list of
+        latencies in seconds, in microseconds
+    """
+    if not latencies:
+        return {}
+    latencies = sorted(latencies)
+    def percentile(p):
+        rank = max(int(round(p / 100.0 * len(latencies))), 1)
+        return latencies[rank - 1] * 1e6
+    return {'p50_us': percentile(50), 'p90_us': percentile(90),
+            'p99_us': percentile(99), 'max_us': latencies[-1] * 1e6,
+            'mean_us': sum(latencies) / len(latencies) * 1e6,
+            'count': len(latencies)}
+
+def _summarize_counts(counts):
+    if not counts:
+        return {}
+    counts = sorted(counts)
+    return {'min': counts[0], 'median': counts[len(counts) // 2],
+            'max': counts[-1], 'total': sum(counts)}
+
+def bench_search(case):
+    """ compute_path between random pairs of squares
+    """
+    gridmap = create_map(case['rows'], case['cols'], case['maze'],
+                         case['density'], case['seed'])
+    t = default_timer()
+    search = create_search(case['backend'], gridmap,
+                           case['queue'] or 'indexed')
+    setup = default_timer() - t
+
+    latencies = []
+    expansions = []
+    found = 0
+    for start, goal in free_pairs(gridmap, case['queries'], case['seed']):
+        before = search.expansions
+        t = default_timer()
+        path = list(search.compute_path(start, goal))
+        latencies.append(default_timer() - t)
+        expansions.append(search.expansions - before)
+        if path:
+            found += 1
+    return {'setup_s': setup, 'query': summarize(latencies),
+            'expansions': _summarize_counts(expansions), 'found': found}
+
+def create_gridpath(case):
+    """ Create the GridPath of 'case', with the map of create_map and
+        the search 'backend' ('field' for distance fields), and a 
+        random (start, goal) pair of free squares. Returns (gridpath,
+        start, goal), or None if no square is free.
+    """
+    rows, cols = case['rows'], case['cols']
+    source = create_map(rows, cols, case['maze'], case['density'],
+                        case['seed'])
+    pairs = free_pairs(source, 1, case['seed'])
+    if not pairs:
+        return None
+    start, goal = pairs[0]
+
+    search = case['backend']
+    if search == 'field':
+        search = None
+    elif search in ('pathfinder', 'hpa', 'alt'):
+        search = lambda gridmap: create_search(case['backend'], gridmap,
+                                               case['queue'] or 'indexed')
+    gridpath = GridPath(rows, cols, goal, search)
+    gridpath.set_blocked_many((row, col) for row in xrange(rows)
+                                         for col in xrange(cols)
+                                         if source.is_blocked((row, col)))
+    return gridpath, start, goal
+
+def bench_gridpath(case):
+    """ GridPath.get_next: the first query (which builds the path
+        data), lookups along the path, and queries after random
+        edits that keep the path connected
+    """
+    created = create_gridpath(case)
+    if created is None:
+        return {}
+    gridpath, start, goal = created
+    rows, cols = case['rows'], case['cols']
+
+    t = default_timer()
+    gridpath.get_next(start)
+    first = default_timer() - t
+
+    lookups = []
+    for coord in gridpath.get_path(start)[:1000]:
+        t = default_timer()
+        gridpath.get_next(coord)
+        lookups.append(default_timer() - t)
+
+    rand = random.Random(case['seed'])
+    edits = []
+    expansions = []
+    for i in xrange(case['queries']):
+        coord = (rand.randrange(rows), rand.randrange(cols))
+        if coord == goal or coord == start:
+            continue
+        blocked = not gridpath.map.is_blocked(coord)
+        if blocked and gridpath.would_disconnect([coord], start):
+            continue
+        before = gridpath.expansions
+        t = default_timer()
+        gridpath.set_blocked(coord, blocked)
+        gridpath.get_next(start)
+        edits.append(default_timer() - t)
+        expansions.append(gridpath.expansions - before)
+
+    return {'first_query_s': first, 'lookup': summarize(lookups),
+            'edit': summarize(edits),
+            'expansions': _summarize_counts(expansions),
+            'path_length': gridpath.path_length(start)}
+
+def bench_cache(case):
+    """ The LRU cache of path tables of a per-query search (the
+        distance fields don't use it): a tower is placed on the path
+        and taken away again, as when the player tries a position,
+        and GridPath.get_next is queried after each. The query after
+        placing it is on a new state of the grid (a miss); the one 
+        after taking it away is back on the previous state, whose
+        table is still cached (a hit).
+    """
+    created = create_gridpath(case)
+    if created is None:
+        return {}
+    gridpath, start, goal = created
+    if gridpath.get_next(start) is None:
+        return {}
+
+    rand = random.Random(case['seed'])
+    placed = []
+    removed = []
+    # The cache hits and misses of the timed queries only
+    counts = {'placed': [0, 0], 'removed': [0, 0]}
+    def timed(kind, latencies, coord, blocked):
+        before = gridpath.cache_stats()
+        t = default_timer()
+        gridpath.set_blocked(coord, blocked)
+        gridpath.get_next(start)
+        latencies.append(default_timer() - t)
+        stats = gridpath.cache_stats()
+        counts[kind][0] += stats['hits'] - before['hits']
+        counts[kind][1] += stats['misses'] - before['misses']
+
+    for i in xrange(case['queries']):
+        path = gridpath.get_path(start)
+        coord = path[rand.randrange(len(path))]
+        if (coord == goal or coord == start or 
+            gridpath.would_disconnect([coord], start)):
+            continue
+        timed('placed', placed, coord, True)
+        timed('removed', removed, coord, False)
+
+    stats = gridpath.cache_stats()
+    return {'placed': summarize(placed), 'removed': summarize(removed),
+            'placed_hits': counts['placed'][0], 
+            'placed_misses': counts['placed'][1],
+            'removed_hits': counts['removed'][0],
+            'removed_misses': counts['removed'][1],
+            'evictions': stats['evictions'], 'entries': stats['entries'],
+            'bytes': stats['bytes']}
+
+def bench_queue(case):
+    """ The priority queue 'queue' (one of QUEUES): batches of adds
+        (with updates of queued items) and pop_smallests of Nodes, as
+        done by A*
+    """
+    rand = random.Random(case['seed'])
+    batch = min(case['rows'] * case['cols'], 10000)
+    adds = []
+    pops = []
+    for i in xrange(case['queries']):
+        nodes = []
+        for j in xrange(batch):
+            node = Node((rand.randrange(case['rows']),
+                         rand.randrange(case['cols'])))
+            node.f_cost = rand.random()
+            nodes.append(node)
+        queue = QUEUES[case['queue']]()
+        t = default_timer()
+        for node in nodes:
+            queue.add(node)
+        adds.append((default_timer() - t) / batch)
+        size = len(queue)
+        t = default_timer()
+        while queue:
+            queue.pop_smallest()
+        pops.append((default_timer() - t) / max(size, 1))
+    return {'batch': batch, 'add': summarize(adds), 'pop': summarize(pops)}
+
+BENCHMARKS = {
+    'search': bench_search,
+    'gridpath': bench_gridpath,
+    'cache': bench_cache,
+    'queue': bench_queue,
+}
+
+def run_case(case):
+    """ Run a benchmark case in this process. Returns the case with
+        its results and the peak memory of the process.
+    """
+    baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    t = default_timer()
+    results = BENCHMARKS[case['suite']](case)
+    result = dict(case)
+    result.update(results)
+    result['elapsed_s'] = default_timer() - t
+    result['baseline_rss_kb'] = baseline
+    result['peak_rss_kb'] = resource.getrusage(
+        resource.RUSAGE_SELF).ru_maxrss
+    return result
+
+def run_isolated(case):
+    """ Run a benchmark case in a new interpreter
+    """
+    process = subprocess.Popen([sys.executable, __file__, '--case',
+                                json.dumps(case)], stdout=subprocess.PIPE)
+    output = process.communicate()[0]
+    if process.returncode != 0:
+        result = dict(case)
+        result['error'] = "exit status %s" % process.returncode
+        return result
+    return json.loads(output)
+
+def create_cases(args):
+    """ The cases of the matrix given by the command line 'args'
+    """
+    cases = []
+    for size in args.sizes.split(','):
+        cols, rows = [int(n) for n in size.split('x')]
+        for maze in args.mazes.split(','):
+            # A serpentine maze has no density
+            densities = ([0.0] if maze == 'serpentine' else
+                         [float(d) for d in args.densities.split(',')])
+            for density in densities:
+                for suite in args.suites.split(','):
+                    if suite == 'queue':
+                        if maze != 'random' or density != densities[0]:
+                            continue
+                        backends = ['']
+                    elif suite == 'gridpath':
+                        backends = ['field'] + args.backends.split(',')
+                    else:
+                        backends = args.backends.split(',')
+                    for backend in backends:
+                        # The generic PathFinder is too slow for the
+                        # large grids
+                        if (backend == 'pathfinder' and
+                            args.pathfinder_max_squares and
+                            rows * cols > args.pathfinder_max_squares):
+                            continue
+                        queues = [None]
+                        if suite == 'queue' or backend == 'pathfinder':
+                            queues = args.queues.split(',')
+                        for queue in queues:
+                            cases.append({'suite': suite,
+                                          'backend': backend,
+                                          'queue': queue,
+                                          'rows': rows, 'cols': cols,
+                                          'maze': maze,
+                                          'density': density,
+                                          'seed': args.seed,
+                                          'queries': args.queries})
+    return cases
+
+def main():
+    parser = argparse.ArgumentParser(description="Pathfinder benchmarks")
+    parser.add_argument('--suites', default=','.join(SUITES),
+                        help="comma separated, of %s" % ', '.join(SUITES))
+    parser.add_argument('--backends', default='pathfinder,astar,alt,jps,dial,hpa',
+                        help="the per-query searches to compare")
+    parser.add_argument('--queues', default=','.join(sorted(QUEUES)),
+                        help="the priority queues to compare, of %s "
+                             "(in the queue suite and as the open set "
+                             "of 'pathfinder')" % ', '.join(sorted(QUEUES)))
+    parser.add_argument('--pathfinder-max-squares', type=int,
+                        default=100*100,
+                        help="skip 'pathfinder' on grids of more squares "
+                             "(0 for no limit)")
+    parser.add_argument('--sizes', default='20x18,100x100,300x300,1000x1000',
+                        help="comma separated COLSxROWS grid sizes")
+    parser.add_argument('--densities', default='0.0,0.2,0.35',
+                        help="obstacle densities of the random mazes")
+    parser.add_argument('--mazes', default='random,serpentine')
+    parser.add_argument('--queries', type=int, default=20,
+                        help="queries (or queue batches) per case")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--inline', action='store_true',
+                        help="run the cases in this process; the peak "
+                             "memory then covers all the previous cases")
+    parser.add_argument('--output', help="write the JSON here instead of "
+                                         "to stdout")
+    parser.add_argument('--case', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.case:
+        print json.dumps(run_case(json.loads(args.case)))
+        return
+
+    results = []
+    for case in create_cases(args):
+        sys.stderr.write("%(suite)s %(backend)s %(queue)s "
+                         "%(cols)sx%(rows)s %(maze)s %(density)s\n" % case)
+        results.append(run_case(case) if args.inline else run_isolated(case))
+
+    report = {'python': platform.python_version(),
+              'platform': platform.platform(),
+              'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+              'results': results}
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(report, output, indent=1, sort_keys=True)
+    else:
+        print json.dumps(report, indent=1, sort_keys=True)
+
+if __name__ == "__main__":
+    main()
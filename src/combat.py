@@ -0,0 +1,239 @@
+'''
+Tower combat.
+
+Towers that shoot at the creeps of a CreepSwarm.
+'''
+
+import numpy
+
+from shared import TILE_SIZE, FIELD_RECT, SUBPIXELS, Scheduler
+
+# The target policies of the turrets: the creep nearest to its goal,
+# the creep nearest to the tower, or the creep with the most health
+FIRST = 'first'
+CLOSEST = 'closest'
+STRONGEST = 'strongest'
+POLICIES = (FIRST, CLOSEST, STRONGEST)
+
+class SpatialHash(object):
+    """ The live creeps of a CreepSwarm, bucketed by the square they
+        are on, for range queries.
+
+        rebuild() buckets all the creeps at once: their indices are
+        sorted by the linear index of their square ('order'), and
+        start[cell] is where the creeps of 'cell' begin in 'order'.
+        The squares of a row are consecutive, so the creeps of a run
+        of squares of a row are a slice of 'order', and a query only
+        looks at the squares its circle overlaps: its cost grows with
+        the number of creeps around it, not with the whole swarm.
+    """
+    def __init__(self, rows, cols):
+        self.rows = rows
+        self.cols = cols
+        self.order = numpy.zeros(0, dtype=numpy.int64)
+        self.start = numpy.zeros(rows * cols + 1, dtype=numpy.int64)
+        # The swarm and its version bucketed last
+        self._state = (None, None)
+
+    def rebuild(self, swarm):
+        """ Bucket the live creeps of 'swarm', unless they haven't
+            changed since the last time
+        """
+        if self._state == (swarm, swarm.version):
+            return
+        self._state = (swarm, swarm.version)
+        index = numpy.flatnonzero(swarm.alive[:swarm.count])
+        cell = swarm.coord[index, 0] * self.cols + swarm.coord[index, 1]
+        order = numpy.argsort(cell, kind='mergesort')
+        self.order = index[order]
+        self.start = numpy.searchsorted(cell[order],
+                                        numpy.arange(self.rows * self.cols + 1))
+
+    def cell(self, coord):
+        """ The indices of the creeps on the square at 'coord'
+        """
+        cell = coord[0] * self.cols + coord[1]
+        return self.order[self.start[cell]:self.start[cell + 1]]
+
+    def query(self, pos, center, radius):
+        """ The indices of the creeps within 'radius' of 'center',
+            where 'pos' are the positions of the creeps (see
+            CreepSwarm.pos), and all are in 1/SUBPIXELS of a pixel
+        """
+        x, y = center
+        size = TILE_SIZE * SUBPIXELS
+        left, top = FIELD_RECT.left * SUBPIXELS, FIELD_RECT.top * SUBPIXELS
+        row0 = max((y - radius - top) // size, 0)
+        row1 = min((y + radius - top) // size, self.rows - 1)
+        col0 = max((x - radius - left) // size, 0)
+        col1 = min((x + radius - left) // size, self.cols - 1)
+        if row0 > row1 or col0 > col1:
+            return self.order[:0]
+
+        start = self.start
+        candidates = numpy.concatenate(
+            [self.order[start[row * self.cols + col0]:
+                        start[row * self.cols + col1 + 1]]
+             for row in xrange(row0, row1 + 1)])
+        offset = pos[candidates] - (x, y)
+        return candidates[(offset * offset).sum(axis=1) <= radius * radius]
+
+class Turret(object):
+    """ The gun of a tower
+    """
+    def __init__(self, position, size=2, range=60, damage=10, rate=2.0,
+                 policy=FIRST, projectile_speed=0.4):
+        """ Create a new Turret.
+
+            position, size:
+                The (row, col) of the top-left square of the size X
+                size tower
+
+            range:
+                How far it shoots, in pixels from the middle of the
+                tower
+
+            damage:
+                The health taken by a hit
+
+            rate:
+                The shots per second
+
+            policy:
+                Which creep in range to shoot, one of POLICIES
+
+            projectile_speed:
+                The speed of its projectiles in px/ms (see
+                projectiles), or None to hit the target at once
+        """
+        if not policy in POLICIES:
+            raise ValueError("unknown target policy %r" % (policy,))
+        self.position = position
+        self.size = size
+        self.range = range
+        self.damage = damage
+        self.policy = policy
+        self.projectile_speed = projectile_speed
+        # The time between two shots, in ms, and the ScheduledCall
+        # that reloads it after a shot (None when loaded)
+        self.cooldown = int(round(1000 / rate))
+        self.reloading = None
+
+        row, col = position
+        self.center = ((FIELD_RECT.left + col * TILE_SIZE +
+                        size * TILE_SIZE / 2) * SUBPIXELS,
+                       (FIELD_RECT.top + row * TILE_SIZE +
+                        size * TILE_SIZE / 2) * SUBPIXELS)
+
+    def reload(self):
+        """ Make it ready to shoot again
+        """
+        self.reloading = None
+
+class Combat(object):
+    """ The turrets shooting at the creeps of a CreepSwarm.
+
+        Every update, the loaded turrets pick a target in range,
+        found through a SpatialHash of the creeps (rebuilt when a
+        turret is loaded). The 'first' creeps are the ones with the
+        shortest way left to their goals, along the paths of the
+        GridPath.
+
+        A turret that shoots is reloaded by a call of a Scheduler,
+        'cooldown' ms later: either the one of the owner (e.g. the 
+        game's, advanced every tick before update), or one of its 
+        own, advanced by update.
+    """
+    def __init__(self, swarm, gridpath, scheduler=None):
+        self.swarm = swarm
+        self.gridpath = gridpath
+        self.turrets = []
+        self.grid = SpatialHash(swarm.rows, swarm.cols)
+        self._own_scheduler = scheduler is None
+        self.scheduler = scheduler if scheduler is not None else Scheduler()
+
+    def add_turret(self, turret):
+        self.turrets.append(turret)
+
+    def remove_turret(self, turret):
+        self.turrets.remove(turret)
+        if turret.reloading is not None:
+            turret.reloading.cancel()
+            turret.reloading = None
+
+    def update(self, time_passed):
+        """ Let the loaded turrets shoot, after 'time_passed' ms
+            (advancing the Scheduler, if it's its own). Returns the
+            shots, as a list of (turret, creep index) pairs.
+        """
+        if self._own_scheduler:
+            self.scheduler.advance(time_passed)
+        loaded = [turret for turret in self.turrets 
+                  if turret.reloading is None]
+        if not loaded or not len(self.swarm):
+            return []
+
+        self.grid.rebuild(self.swarm)
+        shots = []
+        for turret in loaded:
+            candidates = self.grid.query(self.swarm.pos, turret.center,
+                                         turret.range * SUBPIXELS)
+            if not len(candidates):
+                continue
+            shots.append((turret, self._select(turret, candidates)))
+            turret.reloading = self.scheduler.schedule(turret.cooldown,
+                                                       turret.reload)
+        return shots
+
+    def damage(self, index, damage):
+        """ Take 'damage' from the health of the creeps at 'index'
+            (arrays; a creep may be in more than once), e.g. the hits
+            of the projectiles and the shots of the turrets that hit
+            at once. Returns the indices of the creeps killed (they
+            are still alive; see CreepSwarm.remove).
+        """
+        swarm = self.swarm
+        index = numpy.asarray(index, dtype=numpy.int64)
+        numpy.subtract.at(swarm.health, index, damage)
+        index = numpy.unique(index)
+        return index[swarm.alive[index] & (swarm.health[index] <= 0)]
+
+    def _select(self, turret, candidates):
+        if turret.policy == CLOSEST:
+            offset = self.swarm.pos[candidates] - turret.center
+            key = (offset * offset).sum(axis=1)
+        elif turret.policy == STRONGEST:
+            key = -self.swarm.health[candidates]
+        else:
+            key = self.remaining(candidates)
+        # the ties go to the lowest index
+        best = numpy.flatnonzero(key == key.min())
+        return candidates[best].min()
+
+    def remaining(self, index):
+        """ The length of the way left to their goals, along their
+            paths, of the creeps at 'index' (an array), in 1/SUBPIXELS
+            of a pixel. The creeps with no path left are the last.
+        """
+        swarm = self.swarm
+        coord = swarm.coord[index]
+        steps = numpy.empty(len(index), dtype=numpy.int64)
+        steps.fill(-1)
+        goal = swarm.goal[index]
+        for goal_index, goal_coords in enumerate(swarm.goals):
+            selected = goal == goal_index
+            if selected.any():
+                lengths = self.gridpath.path_lengths(goal_coords)
+                steps[selected] = lengths[coord[selected, 0],
+                                          coord[selected, 1]]
+
+        # From the middle of the square, the way left is whole
+        # squares; the creeps before the middle have a bit more
+        size = TILE_SIZE * SUBPIXELS
+        mid = (coord[:, ::-1] * size +
+               (FIELD_RECT.left * SUBPIXELS + size / 2,
+                FIELD_RECT.top * SUBPIXELS + size / 2))
+        along = ((mid - swarm.pos[index]) * swarm.direction[index]).sum(axis=1)
+        remaining = steps * size + along
+        remaining[steps < 0] = numpy.iinfo(numpy.int64).max
+        return remaining
@@ -3,117 +3,248 @@ Created on 13 mar 2010
 
 @author: Freddie
 '''
-from random import randint, choice
-from math import sin, cos, radians
-
+import numpy
 import pygame
-from shared import TILE_SIZE, xy2coord, coord2xy_mid, Vector2D as v
+from shared import TILE_SIZE, FIELD_RECT, TICK_TIME, SUBPIXELS, xy2coord
+
 
+def creep_image(w, h):
+    """ The image of a creep with a w X h rect
+    """
+    surface = pygame.Surface((w-1, h-1))
+    surface.fill((0,0,0,0))
+    pygame.draw.circle(surface, (0,0,255),((w-1)/2+1,(h-1)/2+1), w/2-1)
+    surface.set_colorkey((0,0,0))
+    return surface
+
+class CreepSprite(pygame.sprite.Sprite):
+    """ The sprite of a creep of a CreepSwarm. It doesn't move by 
+        itself; the renderer moves its rect to the creep.
+    """
+    def __init__(self, image, rect):
+        pygame.sprite.Sprite.__init__(self)
+        self.image = image
+        self.rect = rect
 
-class Creep(pygame.sprite.Sprite):
-    """ A creep sprite that bounces off walls and changes its
-        direction from time to time.
+class CreepSwarm(object):
+    """ All the creeps of a field, simulated together.
+    
+        The state of the creeps is kept in NumPy arrays, one element
+        (or row) per creep, and every update (a simulation tick of
+        'tick' ms) moves all of them with a few vectorized steps:
+        
+        pos:
+            The (x, y) positions on the screen, in fixed point: in 
+            1/SUBPIXELS of a pixel
+        direction:
+            The (dx, dy) directions, each -1, 0 or 1
+        speed:
+            The distances moved per tick, in 1/SUBPIXELS of a pixel
+        coord:
+            The (row, col) coordinates the creeps are on
+        goal:
+            The index of the goal in 'goals'
+        health:
+            The hit points left
+        alive, waiting:
+            The state flags. A creep is waiting when the next 
+            coordinate on its path isn't known, and it can't keep 
+            going the same way.
+        
+        A creep only turns at the middle of a square, to the next
+        coordinate on its path. The positions are integers, so a 
+        creep always stops exactly at the middle, whatever its 
+        speed, and the simulation gives the same results on every 
+        machine. The next coordinates of all the creeps at the 
+        middle of a square are looked up at once, in the next hop 
+        arrays of their goals (see GridPath.next_hops).
+        
+        The slots of dead creeps are reused by the next ones. The
+        swarm is only the state of the creeps: a renderer can draw
+        them with CreepSprites (all sharing one image), moved to the
+        positions before drawing.
     """
-    def __init__(self, pos, bounds, direction, speed, next_coord_function):
-        """ Create a new Creep.
-                
+    def __init__(self, rows, cols, capacity=64, tick=TICK_TIME):
+        self.rows = rows
+        self.cols = cols
+        self.tick = tick
+        
+        # The number of slots in use, including the dead creeps'
+        self.count = 0
+        self.pos = numpy.zeros((capacity, 2), dtype=numpy.int64)
+        self.direction = numpy.zeros((capacity, 2), dtype=numpy.int64)
+        self.speed = numpy.zeros(capacity, dtype=numpy.int64)
+        self.coord = numpy.zeros((capacity, 2), dtype=numpy.int32)
+        self.goal = numpy.zeros(capacity, dtype=numpy.int32)
+        self.health = numpy.zeros(capacity, dtype=numpy.int64)
+        self.alive = numpy.zeros(capacity, dtype=bool)
+        self.waiting = numpy.zeros(capacity, dtype=bool)
+        # The slots of the dead creeps
+        self._free = []
+        # Incremented on every change of the creeps
+        self.version = 0
+        
+        # The goals (frozensets of coords), and whether each coord is
+        # part of them, as a goals X rows X cols array
+        self.goals = []
+        self._goal_masks = numpy.zeros((0, rows, cols), dtype=bool)
+
+    
+    def __len__(self):
+        """ The number of live creeps
+        """
+        return self.count - len(self._free)
+    
+    def spawn(self, pos, direction, speed, goal, health=100):
+        """ Add a creep. Returns its index.
+        
             pos:
-                A vec2d or a pair specifying the initial position
-                of the creep on the screen.
+                The (x, y) initial position, the middle of a square
             
             direction:
-                A vec2d or a pair specifying the initial direction
-                of the creep. Must have an angle that is a 
-                multiple of 45 degres.
+                The (dx, dy) initial direction
+            
+            speed:
+                The speed, in pixels/millisecond (px/ms). A creep
+                must move less than a square per tick.
+            
+            goal:
+                The frozenset of the coordinates the creep is going
+                to.
             
-            speed: 
-                Creep speed, in pixels/millisecond (px/ms)
+            health:
+                The hit points of the creep.
         """
-        pygame.sprite.Sprite.__init__(self)
-        self.speed = int(speed)
-        self.rect = bounds
-
-        surface = pygame.Surface((self.rect.w-1, self.rect.h-1))
-        surface.fill((0,0,0,0))
-        pygame.draw.circle(surface, (0,0,255),((self.rect.w-1)/2+1,(self.rect.h-1)/2+1),
-                           self.rect.w/2-1)
-        surface.set_colorkey((0,0,0))
-        self.image = surface
-#        self.image = pygame.transform.rotate(pygame.image.load("..\img\creep_0.png"), -90)
-        
-        # A vector specifying the creep's position on the screen
-        self.pos = v(pos)
-        self.prev_pos = v(self.pos)
-
-        # The direction is a normalized vector
-        self.direction = v(direction).normalized()
+        step = int(round(speed * self.tick * SUBPIXELS))
+        if step >= TILE_SIZE * SUBPIXELS:
+            raise ValueError("creep speed %r is too fast" % (speed,))
         
-        self.next_on_path = next_coord_function
-    
-    def update(self, time_passed):
-        """ Update the creep.
+        if self._free:
+            index = self._free.pop()
+        else:
+            if self.count == len(self.alive):
+                self._grow()
+            index = self.count
+            self.count += 1
+        
+        if not goal in self.goals:
+            self.goals.append(goal)
+            mask = numpy.zeros((1, self.rows, self.cols), dtype=bool)
+            for row, col in goal:
+                mask[0, row, col] = True
+            self._goal_masks = numpy.concatenate((self._goal_masks, mask))
         
-            time_passed:
-                The time passed (in ms) since the previous update.
+        self.pos[index] = (pos[0] * SUBPIXELS, pos[1] * SUBPIXELS)
+        self.direction[index] = direction
+        self.speed[index] = step
+        self.coord[index] = xy2coord(pos)
+        self.goal[index] = self.goals.index(goal)
+        self.health[index] = health
+        self.alive[index] = True
+        self.waiting[index] = False
+        self.version += 1
+        return index
+    
+    def remove(self, index):
+        """ Remove the creep at 'index'
         """
-        # Maybe it's time to change the direction ?
-        #
-        self._compute_direction(time_passed)
-        # Make the creep image point in the correct direction.
-        # Note that two images are used, one for diagonals
-        # and one for horizontals/verticals.
-        #
-        # round() on the angle is necessary, to make it 
-        # exact, despite small deviations that may result from
-        # floating-point calculations
-        #
-#        if int(round(self.direction.angle)) % 90 == 45:
-#            self.image = pygame.transform.rotate(self.base_image_45,
-#                                                 -(self.direction.angle + 45))
-#        elif int(round(self.direction.angle)) % 90 == 0:
-#            self.image = pygame.transform.rotate(self.base_image_0,
-#                                                 -self.direction.angle)
-#        else:
-#            assert False
-        
-        # Compute and apply the displacement to the position 
-        # vector. The displacement is a vector, having the angle
-        # of self.direction (which is normalized to not affect
-        # the magnitude of the displacement)
-        #
-        displacement = v(self.direction.x * self.speed,
-                         self.direction.y * self.speed)
-        self.prev_pos = v(self.pos)
-        self.pos += displacement
-        self.rect.center = self.pos
-        
-#        # When the image is rotated, its size is changed.
-#        self.image_w, self.image_h = self.image.get_size()
-        
-#    def draw(self):
-#        """ Blit the creep onto the screen that was provided in
-#            the constructor.
-#        """
-#        # The creep image is placed at self.pos. To allow for 
-#        # smooth movement even when the creep rotates and the 
-#        # image size changes, its placement is always 
-#        # centered.
-#        #
-#        self.draw_rect = self.image.get_rect().move(
-#            self.pos.x - self.image_w / 2, 
-#            self.pos.y - self.image_h / 2)
-#        self.screen.blit(self.image, self.draw_rect)
-#    
-    def _compute_direction(self, time_passed):
-        """ Finds out where to go
+        self.alive[index] = False
+        self._free.append(index)
+        self.version += 1
+    
+    def _grow(self):
+        capacity = 2 * len(self.alive)
+        for name in ('pos', 'direction', 'speed', 'coord', 'goal', 'health',
+                     'alive', 'waiting'):
+            old = getattr(self, name)
+            new = numpy.zeros((capacity,) + old.shape[1:], dtype=old.dtype)
+            new[:len(old)] = old
+            setattr(self, name, new)
+    
+    def update(self, next_hops, blocked):
+        """ Move all the creeps for a tick. Returns the indices of the
+            creeps that have reached their goal (they are still 
+            alive; see remove).
+        
+            next_hops:
+                For each of the 'goals', its next hop array (see 
+                GridPath.next_hops), or None if it isn't known (yet).
+                It may be out of date: the next coordinates that are
+                blocked are ignored.
+            
+            blocked:
+                A rows X cols array, true where the field is blocked
+                (e.g. GridMap.as_array).
         """
-        coord = xy2coord(self.pos)
+        index = numpy.flatnonzero(self.alive[:self.count])
+        if not len(index):
+            return index
+        self.version += 1
+        pos = self.pos[index]
+        direction = self.direction[index]
+        speed = self.speed[index]
+        moving = ~self.waiting[index]
         
-        x_mid, y_mid = coord2xy_mid(coord)
-#        if ((x_mid - self.pos.x) * (x_mid - self.prev_pos.x) < 0 or
-#            (y_mid - self.pos.y) * (y_mid - self.prev_pos.y) < 0):
-        if self.pos == (x_mid,y_mid):
-            next_coord = self.next_on_path(coord)
-
-            self.direction = v(next_coord[1] - coord[1],
-                               next_coord[0] - coord[0]).normalized()
+        # The distance to the middle of the next square on the way,
+        # which is the one the creep is on or the one after it
+        size = TILE_SIZE * SUBPIXELS
+        left, top = FIELD_RECT.left * SUBPIXELS, FIELD_RECT.top * SUBPIXELS
+        mid = (pos - (left, top)) // size * size + (left + size / 2, 
+                                                    top + size / 2)
+        along = ((mid - pos) * direction).sum(axis=1)
+        distance = numpy.where(along < 0, along + size, along)
+        distance[~moving] = 0
+        
+        # The creeps that get to it turn there; the others go on
+        arrived = speed >= distance
+        travel = numpy.where(arrived, distance, speed)
+        travel[~moving] = 0
+        pos += direction * travel[:, None]
+        
+        col = (pos[:, 0] - left) // size
+        row = (pos[:, 1] - top) // size
+        
+        turning = numpy.flatnonzero(arrived)
+        t_row, t_col = row[turning], col[turning]
+        goal = self.goal[index[turning]]
+        done = self._goal_masks[goal, t_row, t_col]
+        
+        # Gather the next coordinates from the next hop arrays
+        hop = numpy.empty(len(turning), dtype=numpy.int32)
+        hop.fill(-1)
+        for goal_index, hops in enumerate(next_hops):
+            if hops is not None:
+                selected = goal == goal_index
+                hop[selected] = hops[t_row[selected], t_col[selected]]
+        known = hop >= 0
+        blocked = numpy.asarray(blocked, dtype=bool)
+        known[known] = ~blocked.flat[hop[known]]
+        next_row = numpy.where(known, hop // self.cols, 0)
+        next_col = numpy.where(known, hop % self.cols, 0)
+        
+        # Unknown next coordinates: keep the last direction, if 
+        # possible, and wait otherwise
+        ahead_row = t_row + direction[turning, 1]
+        ahead_col = t_col + direction[turning, 0]
+        ahead = ((0 <= ahead_row) & (ahead_row < self.rows) &
+                 (0 <= ahead_col) & (ahead_col < self.cols))
+        ahead[ahead] = ~blocked[ahead_row[ahead], ahead_col[ahead]]
+        next_row = numpy.where(known, next_row, ahead_row)
+        next_col = numpy.where(known, next_col, ahead_col)
+        
+        go = (known | ahead) & ~done
+        direction[turning[go], 0] = next_col[go] - t_col[go]
+        direction[turning[go], 1] = next_row[go] - t_row[go]
+        waiting = ~moving
+        waiting[turning] = ~go
+        
+        # The rest of the step, after turning
+        rest = numpy.where(go, speed[turning] - travel[turning], 0)
+        pos[turning] += direction[turning] * rest[:, None]
+        
+        self.pos[index] = pos
+        self.direction[index] = direction
+        self.coord[index, 0] = (pos[:, 1] - top) // size
+        self.coord[index, 1] = (pos[:, 0] - left) // size
+        self.waiting[index] = waiting
+        return index[turning[done]]
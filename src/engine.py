@@ -0,0 +1,614 @@
+'''
+Tower Defence engine.
+
+The rules of the game, without any display: the field and its paths,
+the creeps, building towers and the rounds. A renderer (see td) can
+follow a game as an observer, and the game can as well run on its own,
+as fast as possible, e.g.:
+
+    engine = Engine(seed=1, background_paths=False)
+    engine.skip_build()
+    ticks = engine.run(100000)
+'''
+
+from random import Random
+
+from pygame import Rect
+
+from pathfinder import GridPath
+from pathservice import PathService
+from creep import CreepSwarm
+from combat import Combat, Turret
+from projectiles import Projectiles
+from shared import TILE_SIZE, FIELD_RECT, TICK_TIME, SUBPIXELS, xy2coord, \
+                   coord2xy_mid, Scheduler
+
+# The duration of the build phase, in milliseconds
+BUILD_TIME = 45000
+# The creeps of a round, and the time between their spawns, in 
+# milliseconds
+WAVE_SIZE = 1
+SPAWN_INTERVAL = 1000
+# The ticks between a change of the grid and the use of the new paths
+NEXT_HOPS_DELAY = 2
+
+class Player(object):
+    def __init__(self):
+        self.money = 0
+        self.stuns = 0
+
+class Field(object):
+    """ The playable area: the grid of squares, with the entrances
+        the creeps come from and the exits they go to, and the paths
+        between them.
+    """
+    def __init__(self, bounds=FIELD_RECT):
+        self.bounds = Rect(bounds)
+        # define the entrances (creep spawn portals)
+        self.entrances = [Rect(self.bounds.left+9*TILE_SIZE,
+                               self.bounds.top,
+                               2*TILE_SIZE, TILE_SIZE)]
+        # define the exits
+        self.exits = [Rect(self.bounds.right-11*TILE_SIZE,
+                           self.bounds.bottom-TILE_SIZE,
+                           2*TILE_SIZE,TILE_SIZE)]
+
+        # Create the grid-path representation of the field. By default
+        # the creeps go to the nearest exit.
+        self.rows = self.bounds.h/TILE_SIZE
+        self.cols = self.bounds.w/TILE_SIZE
+        self.gridpath = GridPath(self.rows, self.cols, self.exit_goal())
+        self._buildable = (None, None)
+
+    def portal_coords(self, portal):
+        """ The coords covered by a portal rect
+        """
+        top, left = xy2coord(portal.topleft)
+        bottom, right = xy2coord((portal.right-1, portal.bottom-1))
+        return frozenset((row, col) for row in range(top, bottom+1)
+                                    for col in range(left, right+1))
+
+    def exit_goal(self, index=None):
+        """ The goal (coords) of the exit at 'index', or of the
+            nearest exit if 'index' is None
+        """
+        if index is not None:
+            return self.portal_coords(self.exits[index])
+        return frozenset().union(*[self.portal_coords(portal)
+                                   for portal in self.exits])
+
+    def spawn_coord(self, entrance, goal=None, lengths=None):
+        """ The coord of the 'entrance' portal with the shortest path
+            to 'goal', or None if the goal can't be reached from it.
+            The path lengths are read from 'lengths' (an array of 
+            GridPath.path_lengths) if given, else queried.
+        """
+        best, best_length = None, None
+        for coord in sorted(self.portal_coords(entrance)):
+            if lengths is not None:
+                length = int(lengths[coord])
+                if length < 0:
+                    length = None
+            else:
+                length = self.path_length(coord, goal)
+            if (not self.is_blocked(coord) and length is not None and
+                (best is None or length < best_length)):
+                best, best_length = coord, length
+        return best
+
+    def get_next(self, coord, goal=None):
+        return self.gridpath.get_next(coord, goal)
+
+    def get_path(self, coord, goal=None):
+        return self.gridpath.get_path(coord, goal)
+
+    def is_connected(self, coord, goal=None):
+        return self.gridpath.is_connected(coord, goal)
+
+    def path_length(self, coord, goal=None):
+        return self.gridpath.path_length(coord, goal)
+
+    def would_block(self, coords):
+        """ Check if blocking 'coords' would leave an entrance with
+            no path to one of the exits
+        """
+        coords = set(coords)
+        for index in range(len(self.exits)):
+            goal = self.exit_goal(index)
+            for entrance in self.entrances:
+                if all(self.is_blocked(coord) or coord in coords or
+                       self.gridpath.would_disconnect(coords, coord, goal)
+                       for coord in self.portal_coords(entrance)):
+                    return True
+        return False
+
+    def buildable_positions(self, query=None):
+        """ The top-left coords where a tower can be built without
+            blocking (see would_block).
+
+            The positions of each spawn coord and exit are given by
+            query(coord, size, goal), GridPath.buildable_positions by
+            default; it may return None for the ones that aren't
+            known yet (e.g. a query of a PathService that isn't 
+            done), and then so does this.
+        """
+        state, positions = self._buildable
+        if state == self.gridpath.map.hash:
+            return positions
+        if query is None:
+            query = self.gridpath.buildable_positions
+
+        positions = None
+        known = True
+        for index in range(len(self.exits)):
+            goal = self.exit_goal(index)
+            for entrance in self.entrances:
+                reachable = set()
+                for row, col in self.portal_coords(entrance):
+                    if self.is_blocked((row, col)):
+                        continue
+                    # query them all, even once one isn't known
+                    buildable = query((row, col), 2, goal)
+                    if buildable is None:
+                        known = False
+                        continue
+                    # a tower on the spawn coord itself doesn't count
+                    reachable |= (buildable - set(
+                        [(row-1, col-1), (row-1, col), (row, col-1),
+                         (row, col)]))
+                if positions is None:
+                    positions = reachable
+                else:
+                    positions &= reachable
+        if not known:
+            return None
+
+        self._buildable = (self.gridpath.map.hash, positions)
+        return positions
+
+    def block(self, coord):
+        self.gridpath.set_blocked(coord, True)
+
+    def unblock(self, coord):
+        self.gridpath.set_blocked(coord, False)
+
+    def block_many(self, coords):
+        self.gridpath.set_blocked_many(coords, True)
+
+    def unblock_many(self, coords):
+        self.gridpath.set_blocked_many(coords, False)
+
+    def transaction(self):
+        """ A transaction of the grid (see GridPath.transaction)
+        """
+        return self.gridpath.transaction()
+
+    def is_blocked(self, coord):
+        return self.gridpath.map.is_blocked(coord)
+
+    def _get_goal(self):
+        return self.gridpath.goal
+
+    def _set_goal(self, goal):
+        self.gridpath.goal = goal
+
+    goal = property(_get_goal, _set_goal,
+                    "The default goal coordinates (the nearest exit).")
+
+class Engine(object):
+    """ A game of Tower Defence, simulated in ticks (see update).
+
+        A round starts with the build phase, when the player builds
+        towers to make the creeps' path as long as possible, and
+        ends when a creep gets to an exit.
+
+        Observers are told about what happens in the game. An
+        observer is an object with any of the methods:
+
+        on_tower_built(position, size, player):
+            A size X size tower was built, with its top-left square
+            at 'position', by the player or not (a random tower).
+        on_building_changed(building):
+            The build phase started or ended.
+        on_creep_spawned(index), on_creep_finished(index):
+            The creep at 'index' of the swarm has entered the field,
+            or has reached its goal and left it.
+        on_creep_killed(index):
+            The creep at 'index' was shot dead.
+        on_round_over():
+            The round is over.
+
+        The engine only uses pygame for Rects, so it runs without a
+        display.
+    """
+    def __init__(self, seed=None, field=None, background_paths=True,
+                 armed_towers=False):
+        """ Create a new Engine.
+
+            seed:
+                The seed of the random towers and money, None for a
+                different game each time.
+
+            field:
+                The Field to play on (e.g. a subclass that draws
+                itself), None for a new one.
+
+            background_paths:
+                True to compute the creeps' paths in a PathService,
+                False to compute them in the ticks. The game is the
+                same either way.
+            
+            armed_towers:
+                True to give the towers of the player Turrets that
+                shoot at the creeps.
+        """
+        self.rand = Random(seed)
+        # the timed events of the game: the end of the build phase,
+        # the spawns and the reloads of the turrets
+        self.scheduler = Scheduler(TICK_TIME)
+        self.field = field if field is not None else Field()
+        self.path_service = None
+        if background_paths:
+            self.path_service = PathService(self.field.gridpath)
+        self.observers = []
+
+        # the state of all the creeps, moved together
+        self.swarm = CreepSwarm(self.field.rows, self.field.cols)
+        # the next hop arrays in use for the goals of the swarm, and
+        # the (version, due tick, future) of the ones for the current
+        # grid
+        self.next_hops = {}
+        self._next_hops_requests = {}
+        # likewise, the path length arrays of the exits, to pick the
+        # spawn coords with
+        self.path_lengths = {}
+        self._path_lengths_requests = {}
+        # the turrets of the towers, if armed
+        self.armed_towers = armed_towers
+        self.combat = Combat(self.swarm, self.field.gridpath, 
+                             self.scheduler)
+        self.projectiles = Projectiles()
+
+        self.ticks = 0
+        self.round_over = False
+        self._building = False
+        # the ScheduledCalls of the end of the build phase and of the
+        # spawns, and the creeps spawned
+        self._build_end = None
+        self._spawns = None
+        self.spawned = 0
+        self.time = 0
+
+        # the top-left coords of the blocks and of the towers (of
+        # size 2), random or built by the player
+        self.blocks = []
+        self.towers = []
+        self.player_towers = []
+
+        self._create_blocks()
+
+        self.player = Player()
+        self.player.money = self.rand.randint(5,20)
+
+        self._create_random_towers()
+        self.is_building = True
+        self._update_path_lengths()
+
+    def add_observer(self, observer):
+        """ Tell 'observer' about what happens in the game
+        """
+        self.observers.append(observer)
+
+    def remove_observer(self, observer):
+        self.observers.remove(observer)
+
+    def _notify(self, event, *args):
+        for observer in self.observers:
+            method = getattr(observer, 'on_' + event, None)
+            if method is not None:
+                method(*args)
+
+    def close(self):
+        """ Stop the PathService, if any
+        """
+        if self.path_service is not None:
+            self.path_service.close()
+            self.path_service = None
+
+    def set_is_building(self, value):
+        if value != self._building:
+            self._building = value
+            if self._build_end is not None:
+                self._build_end.cancel()
+                self._build_end = None
+            if value:
+                self._build_end = self.scheduler.schedule(BUILD_TIME,
+                                                          self._end_build)
+            elif self._spawns is None:
+                # the round starts on the next tick
+                self._spawns = self.scheduler.schedule(0, self._spawn_wave,
+                                                       SPAWN_INTERVAL)
+            self._notify('building_changed', value)
+
+    def get_is_building(self):
+        return self._building
+
+    is_building = property(get_is_building, set_is_building,
+                           "Whether it's the build phase")
+
+    def _get_build_time(self):
+        if self._build_end is None:
+            return 0
+        return BUILD_TIME - (self._build_end.due - self.scheduler.time)
+
+    build_time = property(_get_build_time, 
+                          doc="The time (ms) the build phase has lasted")
+
+    def skip_build(self):
+        """ End the build phase on the next tick
+        """
+        if self.is_building:
+            self._build_end.cancel()
+            self._build_end = self.scheduler.schedule(0, self._end_build)
+
+    def _end_build(self):
+        self._build_end = None
+        self.is_building = False
+
+    def _spawn_wave(self):
+        self.spawn_creep()
+        self.spawned += 1
+        if self.spawned >= WAVE_SIZE:
+            self._spawns.cancel()
+
+    def _create_blocks(self):
+        rows, cols = self.field.rows, self.field.cols
+        coords = []
+        for col in range(1,9)+range(11,cols-1):
+            coords.append((0, col))
+            coords.append((rows-1, col))
+        for row in range(rows):
+            coords.append((row, 0))
+            coords.append((row, cols-1))
+        self.field.block_many(coords)
+        self.blocks.extend(coords)
+
+    def _create_random_towers(self):
+        tower_count = self.rand.randint(6,15)
+        while len(self.towers) < tower_count:
+            row = self.rand.randint(1,18)
+            col = self.rand.randint(1,18)
+            self.build_tower((row,col), False)
+
+    def build_tower(self, position, player=True, wait=False):
+        """ Build a tower with its top-left square at 'position', for
+            the player (who pays for it) or not. Returns a (built,
+            message) pair, where message tells why it couldn't be
+            built.
+
+            With a PathService, the towers of the player are checked
+            against the buildable positions it computes (see 
+            buildable_positions). While they aren't known, built is
+            None (and message "checking"): try again later, e.g. on
+            the next frame, or 'wait' for them.
+        """
+        row, col = position
+        buildable, message = self._is_buildable(row, col, player, wait)
+        if buildable:
+            if player:
+                self.player.money -= 1
+                self.player_towers.append(position)
+                if self.armed_towers:
+                    self.combat.add_turret(Turret(position))
+            else:
+                self.towers.append(position)
+            self._notify('tower_built', position, 2, player)
+        return (buildable,message)
+
+    def _is_buildable(self, row, col, player=False, wait=False):
+        if self.player.money == 0:
+            self.is_building = False
+            return (False, "insufficient funds")
+        coords = []
+        for i in range(2):
+            for j in range(2):
+                coords.append((row+j, col+i))
+                if self.field.is_blocked((row+i,col+j)):
+                    return (False, "invalid placement")
+
+        # if no path would be left; tower is blocking the creep path.
+        # The random towers are only built before the game starts.
+        if player and self.path_service is not None:
+            positions = self.buildable_positions(wait)
+            if positions is None:
+                return (None, "checking")
+            if (row, col) not in positions:
+                return (False, "blocking")
+        elif self.field.would_block(coords):
+            return (False, "blocking")
+
+        self.field.block_many(coords)
+        return (True, "")
+
+    def buildable_positions(self, wait=False):
+        """ The top-left coords where a tower can be built (see 
+            Field.buildable_positions). With a PathService, they're
+            computed in the background: None until they're known, 
+            unless 'wait'.
+        """
+        if self.path_service is None:
+            return self.field.buildable_positions()
+        def query(coord, size, goal):
+            future = self.path_service.buildable_positions(coord, size,
+                                                           goal)
+            if wait:
+                future.result()
+            if not future.done() or future.stale:
+                return None
+            return future.result()
+        return self.field.buildable_positions(query)
+
+    def spawn_creep(self, entrance_index=0, exit_index=None):
+        """ Spawn a creep at the entrance at 'entrance_index', going
+            to the exit at 'exit_index' (the nearest exit if None).
+            Returns its index in the swarm.
+        """
+        self.is_building = False
+        goal = self.field.exit_goal(exit_index)
+        start = self._get_start_coord(self.field.entrances[entrance_index],
+                                      goal)
+        direction = (0,1)
+        speed = 0.125
+        index = self.swarm.spawn(start, direction, speed, goal)
+        self._notify('creep_spawned', index)
+        return index
+
+    def _get_start_coord(self, entrance, goal):
+        # the path lengths of the exits are always known (see 
+        # _update_path_lengths); any other goal is queried
+        coord = self.field.spawn_coord(entrance, goal, 
+                                       self.path_lengths.get(goal))
+        if coord is None:
+            coord = xy2coord(entrance.topleft)
+        return coord2xy_mid(coord)
+
+    def update(self, time_passed=TICK_TIME):
+        """ Simulate a tick of 'time_passed' ms. Never waits: if the
+            tick isn't ready (see ready), it isn't simulated, and 
+            returns False.
+        """
+        if self.round_over:
+            return False
+        if not self.ready():
+            return False
+        self.ticks += 1
+        self._update_path_lengths()
+        # the build phase ends, the creeps spawn, the turrets reload
+        self.scheduler.advance(time_passed)
+        if self._spawns is not None:
+            self.time += time_passed
+
+        # update all creeps positions
+        self._update_next_hops()
+        finished = self.swarm.update([self.next_hops.get(goal)
+                                      for goal in self.swarm.goals],
+                                     self.field.gridpath.map.as_array())
+        for index in finished:
+            self.swarm.remove(index)
+            self._notify('creep_finished', index)
+            self.round_over = True
+        
+        # the projectiles fly, and the towers shoot; the round is over 
+        # when no creep is left to spawn or on the field
+        index, damage = self.projectiles.update(self.swarm, 
+                                                self.combat.grid)
+        index, damage = list(index), list(damage)
+        for turret, creep in self.combat.update(time_passed):
+            if turret.projectile_speed is None:
+                index.append(creep)
+                damage.append(turret.damage)
+            else:
+                step = int(round(turret.projectile_speed * time_passed * 
+                                 SUBPIXELS))
+                self.projectiles.fire(turret.center, self.swarm.pos[creep],
+                                      step, turret.damage, 
+                                      turret.range * SUBPIXELS + 
+                                      self.projectiles.hit_radius)
+        killed = self.combat.damage(index, damage)
+        for index in killed:
+            self.swarm.remove(index)
+            self._notify('creep_killed', index)
+        if (len(killed) and not len(self.swarm) and 
+            self.spawned >= WAVE_SIZE):
+            self.round_over = True
+        if self.round_over:
+            self._notify('round_over')
+        return True
+
+    def ready(self):
+        """ Check if the next tick can be simulated: it can't while
+            the PathService is still computing next hops or path 
+            lengths that are due then (see _update_arrays). Until then, the caller
+            should hold the ticks back, e.g. keep drawing frames and
+            check again on the next one (see FixedStep).
+        """
+        return not self._pending_next_hops()
+
+    def _pending_next_hops(self):
+        """ The futures of the next hops and path lengths due on the 
+            next tick that aren't done yet
+        """
+        version = self.field.gridpath.version
+        pending = []
+        requests = (self._next_hops_requests.values() + 
+                    self._path_lengths_requests.values())
+        for request_version, due, future in requests:
+            # the requests of an older grid are made again, later
+            if (request_version == version and due is not None and
+                self.ticks + 1 >= due and future is not None and
+                not future.done()):
+                pending.append(future)
+        return pending
+
+    def run(self, max_ticks):
+        """ Simulate until the round is over, at most 'max_ticks'
+            ticks (waiting for the PathService between the ticks, if
+            needed). Returns the number of ticks simulated.
+        """
+        ticks = 0
+        while not self.round_over and ticks < max_ticks:
+            for future in self._pending_next_hops():
+                future.result()
+            self.update()
+            ticks += 1
+        return ticks
+
+    def _update_next_hops(self):
+        """ The creeps going to the same goal share its next hops 
+            (see _update_arrays).
+        """
+        self._update_arrays('next_hops', self.swarm.goals, 
+                            self.next_hops, self._next_hops_requests)
+
+    def _update_path_lengths(self):
+        """ The spawns pick their coord by the path lengths to the
+            exits (see _update_arrays). The first ones are due on the 
+            first tick, so the spawns never query the grid.
+        """
+        goals = [self.field.exit_goal()]
+        for index in range(len(self.field.exits)):
+            goal = self.field.exit_goal(index)
+            if goal not in goals:
+                goals.append(goal)
+        self._update_arrays('path_lengths', goals, self.path_lengths,
+                            self._path_lengths_requests, 1)
+
+    def _update_arrays(self, kind, goals, arrays, requests, 
+                       first_delay=NEXT_HOPS_DELAY):
+        """ Put in use the arrays of GridPath method 'kind' for the
+            'goals' that are due (e.g. next_hops), and request the 
+            ones of the current grid. To keep the simulation 
+            deterministic, the arrays of a new state of the grid are
+            always put in use NEXT_HOPS_DELAY ticks after the change
+            (the first ones of a goal 'first_delay' ticks after it's
+            requested); until then, the previous ones are used. If 
+            the PathService isn't done by then, the tick is held back
+            (see ready), so they're always known here.
+        """
+        version = self.field.gridpath.version
+        for goal in goals:
+            request = requests.get(goal)
+            if request is None or request[0] != version:
+                future = None
+                if self.path_service is not None:
+                    future = getattr(self.path_service, kind)(goal)
+                delay = NEXT_HOPS_DELAY if goal in arrays else first_delay
+                request = (version, self.ticks + delay, future)
+                requests[goal] = request
+            due, future = request[1:]
+            if due is not None and self.ticks >= due:
+                if future is not None:
+                    arrays[goal] = future.result()
+                else:
+                    arrays[goal] = getattr(self.field.gridpath, kind)(goal)
+                requests[goal] = (version, None, None)
@@ -0,0 +1,299 @@
+'''
+Hierarchical pathfinding (HPA*).
+'''
+
+from collections import deque
+
+import heapq
+
+class HierarchicalSearch(object):
+    """ Computes paths on a large 4-connected GridMap with HPA*.
+
+        The map is split into square clusters. Where two neighboring
+        clusters share a run of open squares along their border, the
+        run is an entrance, crossed by one or two transitions: pairs
+        of facing squares, one on each side. The squares of the
+        transitions are the nodes of an abstract graph, connected by
+        the transitions themselves and by the shortest distance
+        between the nodes of each cluster (within the cluster).
+
+        A query connects the start and the goal to the nodes of
+        their clusters, searches the (much smaller) abstract graph
+        with A*, and then refines the abstract path into squares,
+        one cluster at a time. The paths are near optimal, not
+        always the shortest.
+
+        Call set_blocked after changing the map. Only the clusters
+        of the changed squares (and their neighbors, when an
+        entrance changes) are rebuilt, on the next query.
+    """
+    def __init__(self, gridmap, cluster_size=10):
+        if gridmap.diagonal:
+            raise ValueError("HierarchicalSearch needs a 4-connected GridMap")
+        self.map = gridmap
+        self.cluster_size = cluster_size
+        self.cluster_rows = (gridmap.rows + cluster_size - 1) // cluster_size
+        self.cluster_cols = (gridmap.cols + cluster_size - 1) // cluster_size
+        
+        # The number of abstract nodes expanded by all the searches
+        self.expansions = 0
+
+        # The transitions of each border, keyed by the pair of
+        # clusters ((row, col) of the top/left one first)
+        self._transitions = {}
+        # The other sides of the transitions of each node
+        self._partners = {}
+        # For each cluster, the distances between its nodes
+        self._distances = {}
+
+        self._dirty_borders = set()
+        self._dirty_clusters = set()
+        for crow in xrange(self.cluster_rows):
+            for ccol in xrange(self.cluster_cols):
+                self._dirty_clusters.add((crow, ccol))
+                if crow + 1 < self.cluster_rows:
+                    self._dirty_borders.add(((crow, ccol), (crow + 1, ccol)))
+                if ccol + 1 < self.cluster_cols:
+                    self._dirty_borders.add(((crow, ccol), (crow, ccol + 1)))
+
+    def cluster(self, coord):
+        """ The (row, col) of the cluster of 'coord'
+        """
+        return (coord[0] // self.cluster_size, coord[1] // self.cluster_size)
+
+    def set_blocked(self, coord, blocked=True):
+        """ Tell the search that the blocked state of 'coord' has
+            changed.
+        """
+        crow, ccol = cluster = self.cluster(coord)
+        self._dirty_clusters.add(cluster)
+
+        # A square on the edge of its cluster can change the
+        # entrances to the neighboring cluster
+        row_in, col_in = (coord[0] % self.cluster_size,
+                          coord[1] % self.cluster_size)
+        neighbors = []
+        if row_in == 0 and crow > 0:
+            neighbors.append(((crow - 1, ccol), cluster))
+        if row_in == self.cluster_size - 1 and crow + 1 < self.cluster_rows:
+            neighbors.append((cluster, (crow + 1, ccol)))
+        if col_in == 0 and ccol > 0:
+            neighbors.append(((crow, ccol - 1), cluster))
+        if col_in == self.cluster_size - 1 and ccol + 1 < self.cluster_cols:
+            neighbors.append((cluster, (crow, ccol + 1)))
+
+        for border in neighbors:
+            self._dirty_borders.add(border)
+            self._dirty_clusters.update(border)
+
+    def compute_path(self, start, goal):
+        """ Compute the path between the 'start' point and the
+            'goal' point, as a list of the points including the
+            start and goal points themselves.
+
+            If no path was found, an empty list is returned.
+        """
+        if start == goal:
+            return [start]
+        if self.map.is_blocked(goal):
+            return []
+        if self.map.is_blocked(start):
+            # A blocked start can only be left through its open
+            # neighbors, which may be in other clusters
+            paths = [path for path in (self.compute_path(succ, goal)
+                                       for succ in self.map.successors(start))
+                     if path]
+            return [start] + min(paths, key=len) if paths else []
+        self._update()
+
+        start_cluster = self.cluster(start)
+        goal_cluster = self.cluster(goal)
+        targets = set(self._distances[start_cluster])
+        if start_cluster == goal_cluster:
+            targets.add(goal)
+        start_edges = self._cluster_distances(start, start_cluster, targets)
+        goal_edges = self._cluster_distances(goal, goal_cluster)
+
+        # A* on the abstract graph, with the start and the goal
+        # inserted into it
+        g_cost = {start: 0}
+        pred = {start: None}
+        closed_set = set()
+        open_set = [(self._manhattan(start, goal), start)]
+        while open_set:
+            f_cost, node = heapq.heappop(open_set)
+            if node in closed_set:
+                continue
+            if node == goal:
+                return self._refine(pred, goal)
+            closed_set.add(node)
+            self.expansions += 1
+
+            if node == start:
+                edges = start_edges.items()
+            else:
+                edges = self._distances[self.cluster(node)][node].items()
+                if node in goal_edges:
+                    edges.append((goal, goal_edges[node]))
+            edges.extend((partner, 1)
+                         for partner in self._partners.get(node, ()))
+
+            for succ, cost in edges:
+                if succ in closed_set:
+                    continue
+                succ_g_cost = g_cost[node] + cost
+                if succ_g_cost < g_cost.get(succ, succ_g_cost + 1):
+                    g_cost[succ] = succ_g_cost
+                    pred[succ] = node
+                    heapq.heappush(open_set, (
+                        succ_g_cost + self._manhattan(succ, goal), succ))
+
+        return []
+
+    def _manhattan(self, c1, c2):
+        return abs(c1[0] - c2[0]) + abs(c1[1] - c2[1])
+
+    def _update(self):
+        """ Rebuild the dirty borders and clusters
+        """
+        for border in self._dirty_borders:
+            self._build_transitions(border)
+        self._dirty_borders = set()
+
+        for cluster in self._dirty_clusters:
+            nodes = set()
+            for border in self._borders(cluster):
+                for coord_a, coord_b in self._transitions.get(border, ()):
+                    nodes.add(coord_a if border[0] == cluster else coord_b)
+
+            self._distances[cluster] = distances = {}
+            for node in nodes:
+                node_distances = self._cluster_distances(node, cluster, nodes)
+                del node_distances[node]
+                distances[node] = node_distances
+        self._dirty_clusters = set()
+
+    def _bounds(self, cluster):
+        """ The (top, left, bottom, right) rows and columns of
+            'cluster'; bottom and right are exclusive.
+        """
+        size = self.cluster_size
+        return (cluster[0] * size, cluster[1] * size,
+                min((cluster[0] + 1) * size, self.map.rows),
+                min((cluster[1] + 1) * size, self.map.cols))
+
+    def _borders(self, cluster):
+        crow, ccol = cluster
+        return [((crow - 1, ccol), cluster), (cluster, (crow + 1, ccol)),
+                ((crow, ccol - 1), cluster), (cluster, (crow, ccol + 1))]
+
+    def _build_transitions(self, border):
+        """ Find the entrances along 'border' and replace its
+            transitions.
+        """
+        for coord_a, coord_b in self._transitions.pop(border, ()):
+            self._partners[coord_a].discard(coord_b)
+            self._partners[coord_b].discard(coord_a)
+
+        (crow_a, ccol_a), (crow_b, ccol_b) = border
+        size = self.cluster_size
+        if crow_a != crow_b:
+            # Horizontal border: the last row of a, the first of b
+            row = crow_b * size
+            pairs = [((row - 1, col), (row, col)) for col in
+                     xrange(ccol_a * size, min((ccol_a + 1) * size,
+                                               self.map.cols))]
+        else:
+            # Vertical border: the last column of a, the first of b
+            col = ccol_b * size
+            pairs = [((row, col - 1), (row, col)) for row in
+                     xrange(crow_a * size, min((crow_a + 1) * size,
+                                               self.map.rows))]
+
+        transitions = []
+        run = []
+        for coord_a, coord_b in pairs + [(None, None)]:
+            if (coord_a is not None and not self.map.is_blocked(coord_a) and
+                not self.map.is_blocked(coord_b)):
+                run.append((coord_a, coord_b))
+                continue
+
+            # End of an entrance: short ones get a transition in the
+            # middle, long ones one at each end
+            if 0 < len(run) < 6:
+                transitions.append(run[len(run) // 2])
+            elif run:
+                transitions.extend((run[0], run[-1]))
+            run = []
+
+        self._transitions[border] = transitions
+        for coord_a, coord_b in transitions:
+            self._partners.setdefault(coord_a, set()).add(coord_b)
+            self._partners.setdefault(coord_b, set()).add(coord_a)
+
+    def _cluster_distances(self, source, cluster, targets=None):
+        """ Breadth-first search from 'source' within 'cluster'.
+            Returns the distances to the reachable 'targets' (the
+            nodes of the cluster by default).
+        """
+        if targets is None:
+            targets = self._distances[cluster]
+        top, left, bottom, right = self._bounds(cluster)
+
+        distances = {source: 0}
+        result = {}
+        if source in targets:
+            result[source] = 0
+
+        frontier = deque([source])
+        while frontier:
+            coord = frontier.popleft()
+            succ_distance = distances[coord] + 1
+            for succ in self.map.successors(coord):
+                if (top <= succ[0] < bottom and left <= succ[1] < right and
+                    not succ in distances):
+                    distances[succ] = succ_distance
+                    frontier.append(succ)
+                    if succ in targets:
+                        result[succ] = succ_distance
+        return result
+
+    def _refine(self, pred, goal):
+        """ Turn the abstract path to 'goal' into a path of squares
+        """
+        nodes = [goal]
+        while pred[nodes[-1]] is not None:
+            nodes.append(pred[nodes[-1]])
+        nodes.reverse()
+
+        path = [nodes[0]]
+        for node, next_node in zip(nodes, nodes[1:]):
+            if self.cluster(node) != self.cluster(next_node):
+                # A transition
+                path.append(next_node)
+            else:
+                path.extend(self._cluster_path(node, next_node)[1:])
+        return path
+
+    def _cluster_path(self, source, target):
+        """ A shortest path from 'source' to 'target' within their
+            cluster.
+        """
+        top, left, bottom, right = self._bounds(self.cluster(source))
+        pred = {source: None}
+        frontier = deque([source])
+        while frontier:
+            coord = frontier.popleft()
+            if coord == target:
+                break
+            for succ in self.map.successors(coord):
+                if (top <= succ[0] < bottom and left <= succ[1] < right and
+                    not succ in pred):
+                    pred[succ] = coord
+                    frontier.append(succ)
+
+        path = [target]
+        while pred[path[-1]] is not None:
+            path.append(pred[path[-1]])
+        path.reverse()
+        return path
@@ -0,0 +1,139 @@
+'''
+Landmark (ALT) heuristics.
+'''
+
+from pathfinder import DistanceField, FlatAStar
+
+class Landmarks(object):
+    """ Lower bounds of the path lengths on a 4-connected GridMap,
+        from the exact distance fields of a few landmark squares
+        (ALT: A*, landmarks and the triangle inequality).
+
+        For a landmark L, the path from a square v to a goal g is at
+        least |d(L, g) - d(L, v)| long, so the largest of these
+        bounds (and of the Manhattan distance) is a consistent 
+        heuristic. In a maze it is much closer to the real length
+        of the path than the straight line, so A* expands far fewer
+        squares. The landmarks are picked far apart, on the edges
+        of the map, by farthest point selection.
+
+        Call set_blocked after changing the map, and update before
+        the heuristic is used again: the fields are then repaired
+        incrementally. A landmark that gets blocked is replaced.
+    """
+    def __init__(self, gridmap, count=4):
+        self.map = gridmap
+        self.count = count
+        # A DistanceField for each landmark
+        self.fields = []
+        self._stale = True
+
+        # (distances of a field, distance to the goal) of the fields
+        # that reach _goal
+        self._goal = None
+        self._goal_distances = []
+
+    def set_blocked(self, coord, blocked=True):
+        """ Tell the landmarks that the blocked state of 'coord' has
+            changed.
+        """
+        for field in self.fields:
+            field.set_blocked(coord)
+            if blocked and coord in field.goals:
+                self._stale = True
+
+    def update(self):
+        """ Repair the fields after the changes of the map (or pick
+            the landmarks, the first time)
+        """
+        if self._stale:
+            self._select_landmarks()
+            self._stale = False
+        else:
+            for field in self.fields:
+                field.update()
+        self._goal = None
+
+    def heuristic(self, coord, goal):
+        """ A lower bound of the length of the path between 'coord'
+            and 'goal'
+        """
+        if goal != self._goal:
+            self._goal = goal
+            self._goal_distances = [(field.distance, field.distance[goal])
+                                    for field in self.fields
+                                    if goal in field.distance]
+
+        bound = abs(coord[0] - goal[0]) + abs(coord[1] - goal[1])
+        for distance, goal_distance in self._goal_distances:
+            coord_distance = distance.get(coord)
+            if coord_distance is not None:
+                if coord_distance > goal_distance:
+                    landmark_bound = coord_distance - goal_distance
+                else:
+                    landmark_bound = goal_distance - coord_distance
+                if landmark_bound > bound:
+                    bound = landmark_bound
+        return bound
+
+    def _select_landmarks(self):
+        """ Pick the landmarks: the first is the square farthest from
+            an arbitrary free square, and each of the next ones is
+            the square farthest from the landmarks picked so far.
+        """
+        self.fields = []
+        gridmap = self.map
+        seed = None
+        for row in xrange(gridmap.rows):
+            for col in xrange(gridmap.cols):
+                if not gridmap.is_blocked((row, col)):
+                    seed = (row, col)
+                    break
+            if seed is not None:
+                break
+        if seed is None:
+            return
+
+        field = DistanceField(gridmap, [seed])
+        field.update()
+        # The distance of every square to the nearest landmark
+        nearest = field.distance
+        for i in xrange(self.count):
+            landmark = max(nearest, key=nearest.get)
+            if nearest[landmark] == 0:
+                break
+            field = DistanceField(gridmap, [landmark])
+            field.update()
+            if not self.fields:
+                nearest = dict(field.distance)
+            else:
+                for coord, dist in field.distance.iteritems():
+                    if dist < nearest[coord]:
+                        nearest[coord] = dist
+            self.fields.append(field)
+
+class LandmarkSearch(FlatAStar):
+    """ FlatAStar with the heuristic of Landmarks, kept up to date
+        with the map. Can be used as the search of a GridPath:
+
+            GridPath(rows, cols, goal, search=LandmarkSearch)
+    """
+    def __init__(self, gridmap, count=4):
+        self.landmarks = Landmarks(gridmap, count)
+        FlatAStar.__init__(self, gridmap, self.landmarks.heuristic)
+
+    def set_blocked(self, coord, blocked=True):
+        """ Tell the search that the blocked state of 'coord' has
+            changed.
+        """
+        self.landmarks.set_blocked(coord, blocked)
+
+    def compute_path(self, start, goal):
+        """ Compute the path between the 'start' point and the 
+            'goal' point, as a list of the points including the 
+            start and goal points themselves.
+
+            If no path was found, an empty list is returned.
+        """
+        self.landmarks.update()
+        return FlatAStar.compute_path(self, start, goal)
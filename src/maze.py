@@ -0,0 +1,247 @@
+'''
+Maze optimizer.
+
+Searches for tower placements that make the path from the entrance
+to the goal as long as possible, to rate how hard a map can get.
+'''
+
+import multiprocessing
+
+from pathfinder import GridPath
+
+class MazeSnapshot(object):
+    """ A picklable snapshot of a field: its size, goal, blocked
+        coordinates, and the coordinates the creeps can start from
+        (e.g. the squares of the entrance).
+    """
+    def __init__(self, rows, cols, goal, blocked, starts):
+        self.rows = rows
+        self.cols = cols
+        self.goal = goal
+        self.blocked = list(blocked)
+        self.starts = list(starts)
+
+    @classmethod
+    def from_gridpath(cls, gridpath, starts):
+        """ Take a snapshot of the grid of 'gridpath'
+        """
+        gridmap = gridpath.map
+        blocked = [(row, col) for row in xrange(gridmap.rows)
+                              for col in xrange(gridmap.cols)
+                              if gridmap.is_blocked((row, col))]
+        return cls(gridmap.rows, gridmap.cols, gridpath.goal, blocked, starts)
+
+    def create_gridpath(self):
+        """ Create a new GridPath with the state of the snapshot
+        """
+        gridpath = GridPath(self.rows, self.cols, self.goal)
+        for coord in self.blocked:
+            gridpath.set_blocked(coord)
+        return gridpath
+
+class MazeEvaluator(object):
+    """ Scores placements of size X size towers on top of a
+        snapshot. The score of a placement is the length of the
+        shortest path from the starts to the goal, or None if the
+        placement disconnects them.
+
+        The evaluator keeps one GridPath and moves it from one
+        placement to the next by blocking and unblocking only the
+        squares that differ, in one transaction, so the distance 
+        fields are repaired incrementally.
+    """
+    def __init__(self, snapshot, size=2):
+        self.snapshot = snapshot
+        self.size = size
+        self.gridpath = snapshot.create_gridpath()
+        self.placement = frozenset()
+
+    def footprint(self, position):
+        """ The coords covered by a tower at 'position' (top-left)
+        """
+        top, left = position
+        return [(row, col) for row in xrange(top, top + self.size)
+                           for col in xrange(left, left + self.size)]
+
+    def set_placement(self, placement):
+        """ Move the grid to the (legal) 'placement', a collection
+            of tower positions
+        """
+        placement = frozenset(placement)
+        with self.gridpath.transaction():
+            for position in self.placement - placement:
+                self.gridpath.set_blocked_many(self.footprint(position), False)
+            for position in placement - self.placement:
+                self.gridpath.set_blocked_many(self.footprint(position), True)
+        self.placement = placement
+
+    def score(self):
+        """ The score of the current placement
+        """
+        best = None
+        for start in self.snapshot.starts:
+            if self.gridpath.map.is_blocked(start):
+                continue
+            length = self.gridpath.path_length(start)
+            if length is not None and (best is None or length < best):
+                best = length
+        return best
+
+    def candidates(self):
+        """ The positions where a tower would change the score of the
+            current placement: the ones with a free footprint that
+            overlaps a shortest path.
+        """
+        best = self.score()
+        if best is None:
+            return []
+
+        path_coords = set()
+        for start in self.snapshot.starts:
+            if (not self.gridpath.map.is_blocked(start) and
+                self.gridpath.path_length(start) == best):
+                path_coords.update(self.gridpath.get_path(start))
+
+        gridmap = self.gridpath.map
+        positions = set()
+        for row, col in path_coords:
+            for top in xrange(max(row - self.size + 1, 0),
+                              min(row, gridmap.rows - self.size) + 1):
+                for left in xrange(max(col - self.size + 1, 0),
+                                   min(col, gridmap.cols - self.size) + 1):
+                    positions.add((top, left))
+
+        return sorted(position for position in positions
+                      if not any(gridmap.is_blocked(coord)
+                                 for coord in self.footprint(position)))
+
+    def evaluate(self, placement, index=0, count=1):
+        """ Score one more tower on top of 'placement', at every
+            index-th of 'count' candidate positions. Returns a list
+            of (score, position) pairs of the legal ones.
+        """
+        self.set_placement(placement)
+
+        results = []
+        for position in self.candidates()[index::count]:
+            with self.gridpath.transaction() as transaction:
+                self.gridpath.set_blocked_many(self.footprint(position))
+                score = self.score()
+                transaction.rollback()
+            if score is not None:
+                results.append((score, position))
+        return results
+
+# The evaluator of a worker process, created by _init_worker
+_evaluator = None
+
+def _init_worker(snapshot, size):
+    global _evaluator
+    _evaluator = MazeEvaluator(snapshot, size)
+
+def _evaluate(args):
+    return _evaluator.evaluate(*args)
+
+class MazeOptimizer(object):
+    """ Searches for the placement of up to 'budget' towers that
+        maximizes the path length from the starts to the goal of a
+        MazeSnapshot, with a beam search: each round adds one tower
+        to each of the best 'beam_width' placements found so far
+        (a beam width of 1 is a greedy search).
+
+        The candidates are scored by a pool of worker processes.
+        Every worker gets the snapshot once, when it starts, and
+        keeps its own MazeEvaluator.
+    """
+    def __init__(self, snapshot, budget, beam_width=8, processes=None,
+                 size=2):
+        """ Create a new MazeOptimizer.
+
+            processes:
+                The number of worker processes, None for one per CPU,
+                or 0 to score the candidates in this process.
+        """
+        self.snapshot = snapshot
+        self.budget = budget
+        self.beam_width = beam_width
+        self.processes = processes
+        self.size = size
+
+    def run(self):
+        """ Run the search. Returns a (score, positions) pair of the
+            best placement found, where positions is a sorted list
+            of the top-left coords of the towers.
+        """
+        if self.processes == 0:
+            evaluator = MazeEvaluator(self.snapshot, self.size)
+            return self._search(lambda tasks: [evaluator.evaluate(*task)
+                                               for task in tasks], 1)
+
+        pool = multiprocessing.Pool(self.processes, _init_worker,
+                                    (self.snapshot, self.size))
+        try:
+            workers = self.processes or multiprocessing.cpu_count()
+            return self._search(lambda tasks: pool.map(_evaluate, tasks),
+                                workers)
+        finally:
+            pool.close()
+            pool.join()
+
+    def _search(self, evaluate_all, workers):
+        base_score = MazeEvaluator(self.snapshot, self.size).score()
+        best = (base_score, frozenset())
+        beam = [best]
+
+        for tower in xrange(self.budget):
+            # Split the candidates of every placement of the beam, so
+            # that all the workers get some
+            count = max(1, (2 * workers + len(beam) - 1) // len(beam))
+            tasks = [(placement, index, count) for score, placement in beam
+                                              for index in xrange(count)]
+
+            children = {}
+            for (score, placement), results in zip(
+                    [beam[i // count] for i in xrange(len(tasks))],
+                    evaluate_all(tasks)):
+                for child_score, position in results:
+                    children[placement | frozenset([position])] = child_score
+
+            if not children:
+                break
+
+            beam = sorted(((score, placement)
+                           for placement, score in children.iteritems()),
+                          key=lambda (score, placement):
+                              (-score, sorted(placement)))[:self.beam_width]
+            if beam[0][0] > best[0]:
+                best = beam[0]
+
+        return best[0], sorted(best[1])
+
+if __name__ == "__main__":
+    # Rate a random 20x18 field like the one of the game
+    import random
+    import time
+
+    rows, cols = 18, 20
+    random.seed(1)
+    blocked = set()
+    for col in range(cols):
+        if not col in (9, 10):
+            blocked.add((0, col))
+            blocked.add((rows - 1, col))
+    for row in range(rows):
+        blocked.add((row, 0))
+        blocked.add((row, cols - 1))
+    for i in range(10):
+        row, col = random.randint(1, rows - 3), random.randint(1, cols - 3)
+        blocked.update([(row, col), (row + 1, col), (row, col + 1),
+                        (row + 1, col + 1)])
+
+    snapshot = MazeSnapshot(rows, cols, frozenset([(17, 9), (17, 10)]),
+                            blocked, [(0, 9), (0, 10)])
+    t = time.time()
+    score, positions = MazeOptimizer(snapshot, 15).run()
+    print "Elapsed: %s" % (time.time() - t)
+    print "Path length: %s" % MazeEvaluator(snapshot).score(), "->", score
+    print positions
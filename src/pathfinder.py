@@ -4,10 +4,15 @@ Pathfinder.
 @author: Freddie
 '''
 
-from collections import defaultdict
-from math import sqrt, fabs
+from collections import deque, OrderedDict
+from math import sqrt
+from timeit import default_timer
 
 import heapq
+import itertools
+import sys
+
+INFINITY = float('inf')
 
 class PriorityQueueSet(object):
     """ Combined priority queue and set data structure. Acts like
@@ -15,11 +20,13 @@ class PriorityQueueSet(object):
         be unique.
         
         Provides O(1) membership test and O(log N) removal of the 
-        *smallest* item. Addition is more complex. When the item 
-        doesn't exist, it's added in O(log N). When it already 
-        exists, its priority is checked against the new item's
-        priority in O(1). If the new item's priority is smaller,
-        it is updated in the queue. This takes O(N).
+        *smallest* item. When the item doesn't exist, it's added 
+        in O(log N). When it already exists, its priority is 
+        checked against the new item's priority in O(1). If the 
+        new item's priority is smaller, it is updated in the queue.
+        This also takes O(log N), since the queue is an indexed 
+        binary heap: the position of every item in the heap is 
+        kept, so the updated item can be sifted up in place.
         
         Important: The items you store in the queue have identity
         (that determines when two items are the same, as far as
@@ -43,8 +50,9 @@ class PriorityQueueSet(object):
     def __init__(self):
         """ Create a new PriorityQueueSet
         """
+        # Maps each item to its position in the heap
         self.set = {}
-        self.heap = []    
+        self.heap = []
 
     def __len__(self):
         return len(self.heap)
@@ -58,8 +66,13 @@ class PriorityQueueSet(object):
         """ Remove and return the smallest item from the queue.
             IndexError will be thrown if the queue is empty.
         """
-        smallest = heapq.heappop(self.heap)
+        smallest = self.heap[0]
+        last = self.heap.pop()
         del self.set[smallest]
+        if self.heap:
+            self.heap[0] = last
+            self.set[last] = 0
+            self._sift_down(0)
         return smallest
     
     def add(self, item):
@@ -73,52 +86,434 @@ class PriorityQueueSet(object):
             Returns True iff the item was added or updated.
         """
         if not item in self.set:
-            self.set[item] = item
-            heapq.heappush(self.heap, item)
+            self.heap.append(item)
+            self.set[item] = len(self.heap) - 1
+            self._sift_up(len(self.heap) - 1)
+            return True
+        
+        pos = self.set[item]
+        if item < self.heap[pos]:
+            self.heap[pos] = item
+            self._sift_up(pos)
             return True
-        elif item < self.set[item]:
-            # No choice but to search linearly in the heap
-            for idx, old_item in enumerate(self.heap):
-                if old_item == item:
-                    del self.heap[idx]
-                    self.heap.append(item)
-                    heapq.heapify(self.heap)
-                    self.set[item] = item
-                    return True
         
         return False
+    
+    def _sift_up(self, pos):
+        heap, index = self.heap, self.set
+        item = heap[pos]
+        while pos > 0:
+            parent_pos = (pos - 1) >> 1
+            parent = heap[parent_pos]
+            if not item < parent:
+                break
+            heap[pos] = parent
+            index[parent] = pos
+            pos = parent_pos
+        heap[pos] = item
+        index[item] = pos
+    
+    def _sift_down(self, pos):
+        heap, index = self.heap, self.set
+        size = len(heap)
+        item = heap[pos]
+        while True:
+            child_pos = 2 * pos + 1
+            if child_pos >= size:
+                break
+            right_pos = child_pos + 1
+            if right_pos < size and heap[right_pos] < heap[child_pos]:
+                child_pos = right_pos
+            child = heap[child_pos]
+            if not child < item:
+                break
+            heap[pos] = child
+            index[child] = pos
+            pos = child_pos
+        heap[pos] = item
+        index[item] = pos
+
+class LazyPriorityQueueSet(object):
+    """ A PriorityQueueSet with the same interface and the same 
+        requirements on the items, that handles priority updates 
+        by lazy deletion instead of an index into the heap.
+        
+        When the priority of an existing item is improved, its 
+        old heap entry is only marked as dead and a new entry is
+        pushed, in O(log N). Dead entries are skipped (and thrown
+        away) by pop_smallest. This trades some memory for cheaper
+        updates than PriorityQueueSet's sifting in place.
+    """
+    def __init__(self):
+        """ Create a new LazyPriorityQueueSet
+        """
+        # Maps each item to its live heap entry
+        self.set = {}
+        self.heap = []
+
+    def __len__(self):
+        return len(self.set)
+
+    def has_item(self, item):
+        """ Check if *item* exists in the queue
+        """
+        return item in self.set
+    
+    def pop_smallest(self):
+        """ Remove and return the smallest item from the queue.
+            IndexError will be thrown if the queue is empty.
+        """
+        while True:
+            entry = heapq.heappop(self.heap)
+            if entry.alive:
+                del self.set[entry.item]
+                return entry.item
+    
+    def add(self, item):
+        """ Add *item* to the queue, or update the priority of the
+            existing item if *item*'s priority is better.
+        
+            Returns True iff the item was added or updated.
+        """
+        entry = self.set.get(item)
+        if entry is not None:
+            if not item < entry.item:
+                return False
+            entry.alive = False
+        
+        entry = _QueueEntry(item)
+        self.set[item] = entry
+        heapq.heappush(self.heap, entry)
+        return True
+
+class _QueueEntry(object):
+    """ A heap entry of LazyPriorityQueueSet
+    """
+    __slots__ = ['item', 'alive']
+    
+    def __init__(self, item):
+        self.item = item
+        self.alive = True
+    
+    def __lt__(self, other):
+        return self.item < other.item
+
+class PathStats(object):
+    """ Counters of path queries, kept by PathFinder and GridPath
+        once their stats are enabled:
+        
+        queries, query_time, max_query_time:
+            The number of searches (or updates of the path data)
+            and the total and the longest time they took, in 
+            seconds.
+        expansions:
+            The nodes expanded by them.
+        pushes, pops, decrease_keys:
+            The operations on the open set of A*: items added,
+            removed, and updated to a better priority.
+        cache_hits, cache_misses:
+            The queries answered from the path data as it was, and
+            the ones that had to search or repair it first.
+        invalidations:
+            The times the path data was told that the grid changed.
+        disconnect_searches:
+            The would_disconnect queries that had to search the grid.
+    """
+    COUNTERS = ('queries', 'query_time', 'max_query_time', 'expansions', 
+                'pushes', 'pops', 'decrease_keys', 'cache_hits', 
+                'cache_misses', 'invalidations', 'disconnect_searches')
+    
+    def __init__(self):
+        self.reset()
+    
+    def reset(self):
+        """ Set all the counters to zero
+        """
+        for name in self.COUNTERS:
+            setattr(self, name, 0)
+    
+    def add_query(self, elapsed, expansions=0):
+        self.queries += 1
+        self.query_time += elapsed
+        if elapsed > self.max_query_time:
+            self.max_query_time = elapsed
+        self.expansions += expansions
+    
+    def snapshot(self, reset=False):
+        """ Get the counters as a dict, and optionally reset them
+        """
+        counters = dict((name, getattr(self, name)) for name in self.COUNTERS)
+        if reset:
+            self.reset()
+        return counters
+
+_counting_queue_classes = {}
+
+def _counting_queue_class(queue_class):
+    """ A subclass of the PriorityQueueSet-like 'queue_class' that 
+        counts its pushes, pops and decrease_keys, for PathStats
+    """
+    if not queue_class in _counting_queue_classes:
+        class CountingQueue(queue_class):
+            pushes = pops = decrease_keys = 0
+            
+            def add(self, item):
+                existed = self.has_item(item)
+                if not queue_class.add(self, item):
+                    return False
+                if existed:
+                    self.decrease_keys += 1
+                else:
+                    self.pushes += 1
+                return True
+            
+            def pop_smallest(self):
+                self.pops += 1
+                return queue_class.pop_smallest(self)
+        
+        _counting_queue_classes[queue_class] = CountingQueue
+    return _counting_queue_classes[queue_class]
+
+class LRUCache(object):
+    """ A mapping that keeps only the most recently used entries.
+    
+        Entries are evicted, least recently used first, when there
+        are more than 'max_entries' of them or when their total size
+        is more than 'max_bytes'. The size of an entry is given when
+        it's put; put it again after the value grows to update it.
+        
+        The hits, misses and evictions are counted, see stats().
+    """
+    def __init__(self, max_entries=64, max_bytes=16 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+    
+    def get(self, key, default=None):
+        """ Get the value of 'key' and mark it as the most recently
+            used, or return 'default' if it isn't cached.
+        """
+        entry = self.entries.pop(key, None)
+        if entry is None:
+            self.misses += 1
+            return default
+        self.hits += 1
+        self.entries[key] = entry
+        return entry[0]
+    
+    def put(self, key, value, size=0):
+        """ Cache 'value' as 'key', taking 'size' bytes, and evict
+            entries as needed. A single entry larger than 'max_bytes'
+            isn't kept at all.
+        """
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.nbytes -= entry[1]
+        self.entries[key] = (value, size)
+        self.nbytes += size
+        
+        while self.entries and (len(self.entries) > self.max_entries or
+                                self.nbytes > self.max_bytes):
+            old_key, (old_value, old_size) = self.entries.popitem(last=False)
+            self.nbytes -= old_size
+            self.evictions += 1
+    
+    def clear(self):
+        self.entries.clear()
+        self.nbytes = 0
+    
+    def __contains__(self, key):
+        return key in self.entries
+    
+    def __len__(self):
+        return len(self.entries)
+    
+    def stats(self):
+        """ Get the counters and the current size of the cache as a
+            dict
+        """
+        return {'hits': self.hits, 'misses': self.misses,
+                'evictions': self.evictions, 'entries': len(self.entries),
+                'bytes': self.nbytes}
+
+_HASH_MASK = (1 << 64) - 1
+
+def _zobrist_key(index):
+    """ The 64-bit random key of the square at the linear 'index'.
+        
+        The keys are derived from the index by the SplitMix64 mixing
+        function instead of being drawn into a table, so that large
+        maps don't need a table of keys.
+    """
+    z = (index + 1) * 0x9E3779B97F4A7C15 & _HASH_MASK
+    z = (z ^ (z >> 30)) * 0xBF58476D1CE4E5B9 & _HASH_MASK
+    z = (z ^ (z >> 27)) * 0x94D049BB133111EB & _HASH_MASK
+    return z ^ (z >> 31)
 
 class GridMap(object):
     """ Represents a rectangular grid map. The map consists of 
         rows X cols coordinates (squares). Some of the squares
         can be blocked (by obstacles).
+        
+        The squares are kept in a flat bytearray ('cells'), one 
+        byte per square (1 for blocked, 0 for free), surrounded by
+        a border of blocked squares. The coordinate (row, col) is 
+        stored at the linear index (row + 1) * stride + col + 1, 
+        so the neighbors of any square of the map can be looked up
+        without bounds checks.
+        
+        'hash' is a Zobrist hash of the set of blocked squares: the 
+        XOR of the random keys of the blocked squares, updated on
+        every change. Two maps (or one map at two times) with the 
+        same blocked squares have the same hash.
+        
+        The moves that can be made from each square are kept as a 
+        bitmask of open directions ('open_dirs', one byte per 
+        square, with the layout of 'cells'), which is updated around
+        a square when it changes. 'moves' maps every bitmask to the
+        tuple of the (index offset, cost) pairs of its directions, 
+        so a search can go through the moves of the square at 
+        'index' with no allocation:
+        
+            for offset, cost in gridmap.moves[gridmap.open_dirs[index]]:
+                succ = index + offset
+        
+        The moves are to the 4 neighbors, and also to the diagonal 
+        ones if the map is 'diagonal'. The moves of a square don't
+        depend on whether the square itself is blocked.
     """
-    def __init__(self, rows, cols):
+    def __init__(self, rows, cols, diagonal=False, cut_corners=False):
         """ Create a new GridMap with specified number of rows and columns.
+        
+            diagonal:
+                Allow diagonal moves (8-connectivity), at the cost 
+                of sqrt(2).
+            
+            cut_corners:
+                If False, a diagonal move needs both of the squares
+                beside it to be free. If True, one of them is 
+                enough (but never squeezes between two blocked 
+                squares).
         """
         self.rows = rows
         self.cols = cols
+        self.stride = cols + 2
+        self.diagonal = diagonal
+        self.cut_corners = cut_corners
+        
+        self.cells = bytearray(self.stride * (rows + 2))
+        last_row = (rows + 1) * self.stride
+        self.cells[:self.stride] = '\x01' * self.stride
+        self.cells[last_row:] = '\x01' * self.stride
+        for index in xrange(self.stride, last_row, self.stride):
+            self.cells[index] = 1
+            self.cells[index + self.stride - 1] = 1
+        
+        self.hash = 0
+        
+        # The (row, col) steps of the directions: up, left, right and
+        # down first (the order of the successors), then the diagonals
+        steps = [(-1, 0), (0, -1), (0, 1), (1, 0)]
+        if diagonal:
+            steps += [(-1, -1), (-1, 1), (1, -1), (1, 1)]
+        self._steps = steps
+        self._offsets = [dr * self.stride + dc for dr, dc in steps]
+        
+        # The steps and the moves of every bitmask
+        self.step_table = []
+        self.moves = []
+        for mask in xrange(1 << len(steps)):
+            bits = [bit for bit in xrange(len(steps)) if mask & (1 << bit)]
+            self.step_table.append(tuple(steps[bit] for bit in bits))
+            self.moves.append(tuple(
+                (self._offsets[bit], 1 if bit < 4 else sqrt(2)) 
+                for bit in bits))
         
-        self.map = [[0] * self.cols for i in range(self.rows)]
-        self.blocked = defaultdict(lambda: False)
+        self.open_dirs = bytearray(len(self.cells))
+        self._init_open_dirs()
+    
+    def _init_open_dirs(self):
+        """ Compute the open directions of the (free) map. All the 
+            inner rows are the same, so only the first of them is 
+            computed and then copied.
+        """
+        rows, stride = self.rows, self.stride
+        for row in sorted(set([0, 1, rows - 1])):
+            if 0 <= row < rows:
+                for col in xrange(self.cols):
+                    self._update_open_dirs(self.index((row, col)))
+        inner = self.open_dirs[2 * stride:3 * stride]
+        for row in xrange(2, rows - 1):
+            self.open_dirs[(row + 1) * stride:(row + 2) * stride] = inner
+    
+    def _update_open_dirs(self, index):
+        """ Recompute the open directions of the square at 'index'
+        """
+        cells = self.cells
+        offsets = self._offsets
+        mask = 0
+        for bit in xrange(4):
+            if not cells[index + offsets[bit]]:
+                mask |= 1 << bit
+        if self.diagonal:
+            for bit in xrange(4, 8):
+                if cells[index + offsets[bit]]:
+                    continue
+                # The squares beside the diagonal move
+                dr, dc = self._steps[bit]
+                beside = (cells[index + dr * self.stride], cells[index + dc])
+                if (not any(beside) or 
+                    (self.cut_corners and not all(beside))):
+                    mask |= 1 << bit
+        self.open_dirs[index] = mask
+    
+    def contains(self, coord):
+        """ Check if 'coord' is a coordinate of the map
+        """
+        return 0 <= coord[0] < self.rows and 0 <= coord[1] < self.cols
+    
+    def index(self, coord):
+        """ The linear index of 'coord' in 'cells'
+        """
+        return (coord[0] + 1) * self.stride + coord[1] + 1
+    
+    def coord(self, index):
+        """ The coordinate stored at the linear 'index' of 'cells'
+        """
+        row, col = divmod(index, self.stride)
+        return (row - 1, col - 1)
     
     def set_blocked(self, coord, blocked=True):
         """ Set the blocked state of a coordinate. True for 
             blocked, False for unblocked.
         """
-        self.map[coord[0]][coord[1]] = blocked
-    
-        if blocked:
-            self.blocked[coord] = True
-        else:
-            if coord in self.blocked:
-                del self.blocked[coord]
+        if not self.contains(coord):
+            raise IndexError("%s is outside of the map" % (coord,))
+        index = (coord[0] + 1) * self.stride + coord[1] + 1
+        value = 1 if blocked else 0
+        if self.cells[index] != value:
+            self.cells[index] = value
+            self.hash ^= _zobrist_key(index)
+            
+            # The moves into the square, and with diagonal moves, the
+            # ones past its corners
+            row, col = coord
+            for dr, dc in self._steps:
+                if 0 <= row + dr < self.rows and 0 <= col + dc < self.cols:
+                    self._update_open_dirs(index + dr * self.stride + dc)
                 
     def is_blocked(self, coord):
-        try:
-            return self.map[coord[0]][coord[1]]
-        except IndexError:
-            return True
+        """ Check if 'coord' is blocked. Coordinates outside of the
+            map are always blocked.
+        """
+        row, col = coord
+        if 0 <= row < self.rows and 0 <= col < self.cols:
+            return self.cells[(row + 1) * self.stride + col + 1] == 1
+        return True
     
     def move_cost(self, c1, c2):
         """ Compute the cost of movement from one coordinate to
@@ -132,30 +527,53 @@ class GridMap(object):
         """ Compute the successors of coordinate 'c': all the 
             coordinates that can be reached by one step from 'c'.
         """
-        slist = []
-        
-        for drow in (-1, 0, 1):
-            for dcol in (-1, 0, 1):
-                if fabs(drow) == fabs(dcol):
-                    continue
-
-                newrow = c[0] + drow
-                newcol = c[1] + dcol
-                if (0 <= newrow <= self.rows-1 and 
-                    0 <= newcol <= self.cols-1 and
-                    self.map[newrow][newcol] == 0):
-                    slist.append((newrow, newcol))
-        return slist
+        row, col = c
+        steps = self.step_table[
+            self.open_dirs[(row + 1) * self.stride + col + 1]]
+        return [(row + dr, col + dc) for dr, dc in steps]
+    
+    def as_array(self):
+        """ Get a rows X cols NumPy uint8 array (1 for blocked) 
+            that is a view of the map, for vectorized consumers. 
+            Requires NumPy.
+        """
+        import numpy
+        padded = numpy.frombuffer(self.cells, dtype=numpy.uint8)
+        padded = padded.reshape(self.rows + 2, self.stride)
+        return padded[1:-1, 1:-1]
     
     def printme(self):
         """ Print the map to stdout in ASCII
         """
         for row in range(self.rows):
             for col in range(self.cols):
-                print "%s" % ('O' if self.map[row][col] else '.'),
+                print "%s" % ('O' if self.is_blocked((row, col)) else '.'),
             print ''
 
-class PathFinder(object):
+class _CountedSearch(object):
+    """ The stats switch of the searches that keep PathStats in 
+        'counters'
+    """
+    counters = None
+    
+    def enable_stats(self, enabled=True):
+        """ Start (or stop) keeping PathStats of the searches. While
+            disabled, they cost nothing.
+        """
+        if not enabled:
+            self.counters = None
+        elif self.counters is None:
+            self.counters = PathStats()
+    
+    def stats(self, reset=False):
+        """ Get a snapshot of the PathStats as a dict (None if they
+            are disabled), and optionally reset them
+        """
+        if self.counters is None:
+            return None
+        return self.counters.snapshot(reset)
+
+class PathFinder(_CountedSearch):
     """ Computes a path in a graph using the A* algorithm.
     
         Initialize the object and then repeatedly compute_path to 
@@ -166,7 +584,8 @@ class PathFinder(object):
         represented as you wish, as long as the functions 
         supplied to the constructor know how to handle them.
     """
-    def __init__(self, successors, move_cost, heuristic_to_goal):
+    def __init__(self, successors, move_cost, heuristic_to_goal,
+                 open_set_class=PriorityQueueSet):
         """ Create a new PathFinder. Provided with several 
             functions that represent your graph and the costs of
             moving through it.
@@ -186,10 +605,22 @@ class PathFinder(object):
                 A function that receives a point and a goal point,
                 and returns the numeric heuristic estimation of 
                 the cost of reaching the goal from the point.
+            
+            open_set_class:
+                The priority queue used for the open set of the 
+                search: PriorityQueueSet (an indexed heap) or 
+                LazyPriorityQueueSet (lazy deletion).
         """
         self.successors = successors
         self.move_cost = move_cost
         self.heuristic_to_goal = heuristic_to_goal
+        self.open_set_class = open_set_class
+        
+        # The number of nodes expanded by all the searches so far
+        self.expansions = 0
+        
+        # PathStats, or None if the stats are disabled
+        self.counters = None
     
     def compute_path(self, start, goal):
         """ Compute the path between the 'start' point and the 
@@ -200,7 +631,21 @@ class PathFinder(object):
             
             If no path was found, an empty list is returned.
         """
-
+        counters = self.counters
+        if counters is None:
+            return self._search(start, goal, self.open_set_class())
+        
+        open_set = _counting_queue_class(self.open_set_class)()
+        expansions = self.expansions
+        t = default_timer()
+        path = self._search(start, goal, open_set)
+        counters.add_query(default_timer() - t, self.expansions - expansions)
+        counters.pushes += open_set.pushes
+        counters.pops += open_set.pops
+        counters.decrease_keys += open_set.decrease_keys
+        return path
+    
+    def _search(self, start, goal, open_set):
         # A* algorithm
 
         closed_set = {}
@@ -209,7 +654,6 @@ class PathFinder(object):
         start_node.g_cost = 0
         start_node.f_cost = self._compute_f_cost(start_node, goal)
         
-        open_set = PriorityQueueSet()
         open_set.add(start_node)
         
         while len(open_set) > 0:
@@ -222,6 +666,7 @@ class PathFinder(object):
                 return self._reconstruct_path(curr_node)
             
             closed_set[curr_node] = curr_node
+            self.expansions += 1
             
             for succ_coord in self.successors(curr_node.coord):
                 succ_node = Node(succ_coord)
@@ -294,6 +739,661 @@ class Node(object):
     def __repr__(self):
         return self.__str__()
 
+_DIAGONAL_EXTRA = sqrt(2) - 1
+
+def _octile(d_row, d_col, diagonal):
+    """ The length of the shortest path over a distance of 
+        (d_row, d_col) on a free map: the Manhattan distance, or with
+        'diagonal' moves, the octile distance
+    """
+    d_row, d_col = abs(d_row), abs(d_col)
+    if not diagonal:
+        return d_row + d_col
+    return max(d_row, d_col) + _DIAGONAL_EXTRA * min(d_row, d_col)
+
+class FlatAStar(_CountedSearch):
+    """ Computes shortest paths on a GridMap using A*, with the 
+        Manhattan distance as the heuristic (or the octile distance,
+        if the map has diagonal moves).
+        
+        Unlike PathFinder, it doesn't create an object per node. The
+        g cost, the parent and the open/closed state of the squares
+        are kept in flat lists indexed by the linear index of the 
+        squares in the GridMap, allocated once and reused by all the
+        searches. Each search has a new generation number, and an
+        entry only counts if it was stamped with the current one, so
+        nothing has to be cleared between the searches.
+        
+        The open set is a heap of plain (f, h, index) tuples: ties
+        on f go to the square closer to the goal. When the g cost of
+        a queued square improves, it's pushed again, and the 
+        outdated entry is skipped when it's popped.
+    """
+    def __init__(self, gridmap, heuristic=None):
+        """ Create a new FlatAStar.
+        
+            heuristic:
+                A function that receives a coord and the goal and 
+                returns a consistent estimate of the cost between 
+                them (e.g. landmarks.Landmarks.heuristic), to use 
+                instead of the Manhattan (or octile) distance.
+        """
+        self.map = gridmap
+        self.heuristic = heuristic
+        size = len(gridmap.cells)
+        self._g_cost = [0] * size
+        self._parent = [0] * size
+        # The generation in which each square was reached, and the
+        # one in which it was closed
+        self._reached = [0] * size
+        self._closed = [0] * size
+        self._generation = 0
+        
+        # The number of squares expanded by all the searches
+        self.expansions = 0
+        # PathStats, or None if the stats are disabled
+        self.counters = None
+    
+    def compute_path(self, start, goal):
+        """ Compute the path between the 'start' point and the 
+            'goal' point, as a list of the points including the 
+            start and goal points themselves.
+            
+            If no path was found, an empty list is returned.
+        """
+        gridmap = self.map
+        if start == goal:
+            return [start]
+        if gridmap.is_blocked(goal):
+            return []
+        counters = self.counters
+        if counters is not None:
+            t = default_timer()
+        
+        moves = gridmap.moves
+        open_dirs = gridmap.open_dirs
+        stride = gridmap.stride
+        diagonal = gridmap.diagonal
+        heuristic = self.heuristic
+        g_cost = self._g_cost
+        parent = self._parent
+        reached = self._reached
+        closed = self._closed
+        self._generation += 1
+        generation = self._generation
+        heappush = heapq.heappush
+        heappop = heapq.heappop
+        
+        start_index = gridmap.index(start)
+        goal_index = gridmap.index(goal)
+        goal_row, goal_col = divmod(goal_index, stride)
+        if heuristic is not None:
+            h = heuristic(start, goal)
+        else:
+            row, col = divmod(start_index, stride)
+            h = _octile(row - goal_row, col - goal_col, diagonal)
+        g_cost[start_index] = 0
+        parent[start_index] = -1
+        reached[start_index] = generation
+        open_set = [(h, h, start_index)]
+        
+        path = []
+        expansions = pops = decrease_keys = 0
+        pushes = 1
+        while open_set:
+            f, h, index = heappop(open_set)
+            pops += 1
+            if closed[index] == generation:
+                continue
+            if index == goal_index:
+                path = self._reconstruct_path(index)
+                break
+            closed[index] = generation
+            expansions += 1
+            
+            index_g_cost = g_cost[index]
+            for offset, cost in moves[open_dirs[index]]:
+                succ = index + offset
+                if closed[succ] == generation:
+                    continue
+                succ_g_cost = index_g_cost + cost
+                if reached[succ] == generation:
+                    if succ_g_cost >= g_cost[succ]:
+                        continue
+                    decrease_keys += 1
+                else:
+                    reached[succ] = generation
+                g_cost[succ] = succ_g_cost
+                parent[succ] = index
+                row, col = divmod(succ, stride)
+                if heuristic is not None:
+                    h = heuristic((row - 1, col - 1), goal)
+                elif diagonal:
+                    h = _octile(row - goal_row, col - goal_col, True)
+                else:
+                    h = abs(row - goal_row) + abs(col - goal_col)
+                heappush(open_set, (succ_g_cost + h, h, succ))
+                pushes += 1
+        
+        self.expansions += expansions
+        if counters is not None:
+            counters.add_query(default_timer() - t, expansions)
+            counters.pushes += pushes
+            counters.pops += pops
+            counters.decrease_keys += decrease_keys
+        return path
+    
+    def _reconstruct_path(self, index):
+        parent = self._parent
+        path = []
+        while index != -1:
+            path.append(self.map.coord(index))
+            index = parent[index]
+        path.reverse()
+        return path
+
+def _check_4_connected(gridmap, search):
+    if gridmap.diagonal:
+        raise ValueError("%s needs a 4-connected GridMap" % 
+                         type(search).__name__)
+
+class JumpPointSearch(object):
+    """ Computes shortest paths on a 4-connected GridMap with 
+        uniform costs, using Jump Point Search.
+        
+        Straight runs of open squares are scanned ("jumped") 
+        without putting their squares on the open set. A scan only
+        stops at a jump point: the goal, or a square where a path 
+        can't be as short by going around it. Horizontal scans stop
+        where an open square appears above or below the scan while
+        the one behind it was blocked. Vertical scans stop at such
+        squares too, and also where a horizontal scan that starts 
+        from them would find a jump point.
+        
+        Returns paths of the same length as PathFinder, but with 
+        far fewer nodes expanded on open maps.
+    """
+    def __init__(self, gridmap):
+        _check_4_connected(gridmap, self)
+        self.map = gridmap
+        # The number of jump points expanded by all the searches
+        self.expansions = 0
+    
+    def compute_path(self, start, goal):
+        """ Compute the path between the 'start' point and the 
+            'goal' point, as a list of the points including the 
+            start and goal points themselves.
+            
+            If no path was found, an empty list is returned.
+        """
+        gridmap = self.map
+        stride = gridmap.stride
+        start_index = gridmap.index(start)
+        goal_index = gridmap.index(goal)
+        goal_row, goal_col = divmod(goal_index, stride)
+        
+        g_cost = {start_index: 0}
+        pred = {start_index: None}
+        closed_set = set()
+        open_set = [(self._distance(start_index, goal_row, goal_col), 
+                     start_index)]
+        
+        while open_set:
+            f_cost, index = heapq.heappop(open_set)
+            if index in closed_set:
+                continue
+            if index == goal_index:
+                return self._reconstruct_path(pred, index)
+            closed_set.add(index)
+            self.expansions += 1
+            
+            for step in self._directions(index, pred[index]):
+                jump_index = self._jump(index, step, goal_index)
+                if jump_index is None or jump_index in closed_set:
+                    continue
+                
+                succ_g_cost = g_cost[index] + self._distance(
+                    jump_index, *divmod(index, stride))
+                if succ_g_cost < g_cost.get(jump_index, INFINITY):
+                    g_cost[jump_index] = succ_g_cost
+                    pred[jump_index] = index
+                    heapq.heappush(open_set, (
+                        succ_g_cost + 
+                        self._distance(jump_index, goal_row, goal_col), 
+                        jump_index))
+        
+        return []
+    
+    def _distance(self, index, row, col):
+        """ The Manhattan distance between a linear index and a 
+            padded (row, col)
+        """
+        index_row, index_col = divmod(index, self.map.stride)
+        return abs(index_row - row) + abs(index_col - col)
+    
+    def _directions(self, index, pred_index):
+        """ The steps (as linear index offsets) to open neighbors 
+            that must be scanned from 'index', when it was reached 
+            from 'pred_index'.
+        """
+        cells = self.map.cells
+        stride = self.map.stride
+        
+        if pred_index is None:
+            steps = (-stride, -1, 1, stride)
+        elif abs(index - pred_index) < stride:
+            # Reached horizontally: keep going, or turn vertically
+            step = 1 if index > pred_index else -1
+            steps = (step, -stride, stride)
+        else:
+            # Reached vertically: keep going, or turn horizontally
+            step = stride if index > pred_index else -stride
+            steps = (step, -1, 1)
+        
+        return [step for step in steps if not cells[index + step]]
+    
+    def _jump(self, index, step, goal_index):
+        """ Scan from 'index' in the direction of 'step' and return 
+            the first jump point, or None if the scan hits a block.
+        """
+        cells = self.map.cells
+        stride = self.map.stride
+        
+        if step == 1 or step == -1:
+            while True:
+                index += step
+                if cells[index]:
+                    return None
+                if index == goal_index:
+                    return index
+                if ((not cells[index - stride] and 
+                     cells[index - step - stride]) or
+                    (not cells[index + stride] and 
+                     cells[index - step + stride])):
+                    return index
+        else:
+            while True:
+                index += step
+                if cells[index]:
+                    return None
+                if index == goal_index:
+                    return index
+                if ((not cells[index - 1] and cells[index - step - 1]) or
+                    (not cells[index + 1] and cells[index - step + 1])):
+                    return index
+                if (self._jump(index, 1, goal_index) is not None or
+                    self._jump(index, -1, goal_index) is not None):
+                    return index
+    
+    def _reconstruct_path(self, pred, index):
+        """ Reconstructs the whole path to 'index' from the start, 
+            filling in the squares between the jump points.
+        """
+        gridmap = self.map
+        stride = gridmap.stride
+        
+        path = [gridmap.coord(index)]
+        while pred[index] is not None:
+            pred_index = pred[index]
+            if abs(index - pred_index) < stride:
+                step = 1 if pred_index > index else -1
+            else:
+                step = stride if pred_index > index else -stride
+            while index != pred_index:
+                index += step
+                path.append(gridmap.coord(index))
+        
+        path.reverse()
+        return path
+
+class BucketQueue(object):
+    """ A priority queue for small non-negative integer priorities 
+        (the bucket queue of Dial's algorithm). There is one bucket 
+        (a list) per priority, so push and pop are O(1), amortized
+        over the scan of empty buckets.
+        
+        The queue is monotone: items pushed with a priority lower 
+        than the last popped one are still popped in order, but the
+        buckets are scanned again from there.
+    """
+    def __init__(self):
+        self.buckets = []
+        self.current = 0
+        self.size = 0
+    
+    def __len__(self):
+        return self.size
+    
+    def push(self, priority, item):
+        """ Add 'item' with the integer 'priority'
+        """
+        while len(self.buckets) <= priority:
+            self.buckets.append([])
+        self.buckets[priority].append(item)
+        if priority < self.current:
+            self.current = priority
+        self.size += 1
+    
+    def pop(self):
+        """ Remove and return a (priority, item) pair with the 
+            smallest priority. IndexError will be thrown if the 
+            queue is empty.
+        """
+        if not self.size:
+            raise IndexError("pop from an empty BucketQueue")
+        while not self.buckets[self.current]:
+            self.current += 1
+        self.size -= 1
+        return self.current, self.buckets[self.current].pop()
+
+class DialSearch(object):
+    """ Computes shortest paths on a 4-connected GridMap with unit 
+        costs, using integer costs and a BucketQueue (A* with Dial's
+        queue and the Manhattan distance as the heuristic).
+        
+        The search runs backwards, from the goal to the start, and 
+        keeps going until every square on a shortest path is settled.
+        The path is then read from the start, taking the first 
+        successor (in the order of GridMap.successors) that is one 
+        step closer to the goal. This is the rule DistanceField 
+        uses, so the paths are exactly those GridPath gives with a 
+        DistanceField.
+    """
+    def __init__(self, gridmap):
+        _check_4_connected(gridmap, self)
+        self.map = gridmap
+        # The number of squares expanded by all the searches
+        self.expansions = 0
+    
+    def compute_path(self, start, goal):
+        """ Compute the path between the 'start' point and the 
+            'goal' point, as a list of the points including the 
+            start and goal points themselves.
+            
+            If no path was found, an empty list is returned.
+        """
+        gridmap = self.map
+        cells = gridmap.cells
+        stride = gridmap.stride
+        if start == goal:
+            return [start]
+        if gridmap.is_blocked(goal):
+            return []
+        
+        start_index = gridmap.index(start)
+        goal_index = gridmap.index(goal)
+        start_row, start_col = divmod(start_index, stride)
+        # A blocked start can still be left through its open 
+        # neighbors, so it's reachable from them (only)
+        start_blocked = cells[start_index]
+        
+        # Distances to the goal
+        g_cost = {goal_index: 0}
+        closed_set = set()
+        open_set = BucketQueue()
+        row, col = divmod(goal_index, stride)
+        open_set.push(abs(row - start_row) + abs(col - start_col), goal_index)
+        best = None
+        
+        while open_set:
+            f_cost, index = open_set.pop()
+            if best is not None and f_cost > best:
+                break
+            if index in closed_set:
+                continue
+            closed_set.add(index)
+            self.expansions += 1
+            if index == start_index:
+                best = g_cost[index]
+                continue
+            
+            succ_g_cost = g_cost[index] + 1
+            for succ in (index - stride, index - 1, index + 1, index + stride):
+                if cells[succ] and not (succ == start_index and start_blocked):
+                    continue
+                if succ_g_cost < g_cost.get(succ, INFINITY):
+                    g_cost[succ] = succ_g_cost
+                    row, col = divmod(succ, stride)
+                    open_set.push(succ_g_cost + abs(row - start_row) + 
+                                  abs(col - start_col), succ)
+        
+        if best is None:
+            return []
+        return self._read_path(g_cost, start_index)
+    
+    def _read_path(self, g_cost, index):
+        cells = self.map.cells
+        stride = self.map.stride
+        
+        path = [self.map.coord(index)]
+        while g_cost[index] > 0:
+            next_g_cost = g_cost[index] - 1
+            for succ in (index - stride, index - 1, index + 1, index + stride):
+                if not cells[succ] and g_cost.get(succ) == next_g_cost:
+                    index = succ
+                    break
+            path.append(self.map.coord(index))
+        return path
+
+class DistanceField(object):
+    """ A distance field rooted at a set of goal coordinates of a 
+        GridMap.
+    
+        A single reverse search from the goals computes, for every 
+        coordinate that can reach one of them, the number of steps 
+        to the nearest goal ('distance') and the next coordinate to
+        move to ('next'). Ties between equally short next steps are
+        broken by the order of GridMap.successors, so the answers 
+        are deterministic.
+        
+        The field doesn't follow the changes of the map by itself.
+        Call set_blocked after the blocked state of a coordinate has
+        changed, and the field will be repaired on the next query.
+        The repair is incremental (LPA* without a heuristic, so that
+        the whole field is kept consistent): only the coordinates 
+        whose distance is actually affected by the change are 
+        visited, and the result is the same as that of a search
+        from scratch.
+    """
+    def __init__(self, gridmap, goals):
+        _check_4_connected(gridmap, self)
+        self.map = gridmap
+        self.goals = frozenset(goals)
+        
+        self.distance = {}
+        self.next = {}
+        self.valid = False
+        
+        # Search state kept between the repairs. 'distance' holds the
+        # g values (coords missing from it have an infinite g), and
+        # _rhs the one-step lookahead values of the inconsistent 
+        # coords, which are queued in _open by min(g, rhs).
+        self._rhs = {}
+        self._open = []
+        self._open_keys = {}
+        self._changed = []
+        
+        # The number of coords expanded by all the computations and
+        # repairs so far
+        self.expansions = 0
+    
+    def invalidate(self):
+        """ Mark the field as outdated. It will be recomputed from
+            scratch by the next query.
+        """
+        self.valid = False
+    
+    def set_blocked(self, coord):
+        """ Tell the field that the blocked state of 'coord' has
+            changed. The field is repaired lazily by the next query.
+        """
+        if self.valid:
+            self._changed.append(coord)
+    
+    def update(self):
+        """ Recompute or repair the field if it is outdated.
+        """
+        if not self.valid:
+            self._compute()
+            self.valid = True
+        elif self._changed:
+            self._repair()
+    
+    def _compute(self):
+        self.distance = distance = {}
+        self.next = next_coords = {}
+        self._rhs = {}
+        self._open = []
+        self._open_keys = {}
+        self._changed = []
+        
+        # Breadth-first search from the goals. Movement costs are 
+        # uniform and the grid is undirected, so this gives the 
+        # exact distance to the nearest goal for every reachable 
+        # coord.
+        frontier = deque()
+        for goal in self.goals:
+            if not self.map.is_blocked(goal):
+                distance[goal] = 0
+                next_coords[goal] = goal
+                frontier.append(goal)
+        
+        while frontier:
+            coord = frontier.popleft()
+            succ_distance = distance[coord] + 1
+            for succ in self.map.successors(coord):
+                if not succ in distance:
+                    distance[succ] = succ_distance
+                    frontier.append(succ)
+        self.expansions += len(distance)
+        
+        for coord, dist in distance.iteritems():
+            if dist > 0:
+                next_coords[coord] = self._best_successor(coord)
+    
+    def _repair(self):
+        changed, self._changed = self._changed, []
+        for coord in changed:
+            self._update_coord(coord)
+            for succ in self.map.successors(coord):
+                self._update_coord(succ)
+        
+        # Only the coords next to a coord whose distance changed can
+        # get a different next coord
+        affected = set(changed)
+        for coord in self._propagate():
+            affected.add(coord)
+            affected.update(self.map.successors(coord))
+        
+        for coord in affected:
+            if not coord in self.distance:
+                self.next.pop(coord, None)
+            elif coord in self.goals:
+                self.next[coord] = coord
+            else:
+                self.next[coord] = self._best_successor(coord)
+    
+    def _update_coord(self, coord):
+        """ Recompute the rhs value of 'coord' and (re)queue it if
+            it has become inconsistent.
+        """
+        if self.map.is_blocked(coord):
+            rhs = INFINITY
+        elif coord in self.goals:
+            rhs = 0
+        else:
+            rhs = INFINITY
+            for succ in self.map.successors(coord):
+                dist = self.distance.get(succ)
+                if dist is not None and dist + 1 < rhs:
+                    rhs = dist + 1
+        
+        g = self.distance.get(coord, INFINITY)
+        if rhs == g:
+            self._rhs.pop(coord, None)
+            self._open_keys.pop(coord, None)
+        else:
+            key = min(g, rhs)
+            self._rhs[coord] = rhs
+            if self._open_keys.get(coord) != key:
+                self._open_keys[coord] = key
+                heapq.heappush(self._open, (key, coord))
+    
+    def _propagate(self):
+        """ Make all the queued coords consistent again. Returns the
+            set of coords whose distance has changed.
+        """
+        changed = set()
+        while self._open:
+            key, coord = heapq.heappop(self._open)
+            if self._open_keys.get(coord) != key:
+                # Outdated queue entry
+                continue
+            del self._open_keys[coord]
+            self.expansions += 1
+            
+            rhs = self._rhs.pop(coord)
+            changed.add(coord)
+            if rhs < self.distance.get(coord, INFINITY):
+                # Overconsistent: the distance is now known
+                self.distance[coord] = rhs
+            else:
+                # Underconsistent: forget the distance and let the
+                # coord (and the ones depending on it) settle again
+                del self.distance[coord]
+                self._update_coord(coord)
+            
+            for succ in self.map.successors(coord):
+                self._update_coord(succ)
+        
+        return changed
+    
+    def _best_successor(self, coord):
+        """ The first successor of 'coord' that is closest to the
+            goal, or None if no successor can reach the goal.
+        """
+        best, best_distance = None, None
+        for succ in self.map.successors(coord):
+            dist = self.distance.get(succ)
+            if dist is not None and (best is None or dist < best_distance):
+                best, best_distance = succ, dist
+        return best
+    
+    def get_next(self, coord):
+        """ Get the next coordinate to move to from 'coord' towards
+            the nearest goal, or None if no goal can be reached.
+        """
+        if coord in self.goals:
+            return coord
+        
+        next_coord = self.next.get(coord)
+        if next_coord is None and self.map.contains(coord):
+            # 'coord' isn't part of the field (e.g. it's blocked 
+            # itself), but it may still be next to it
+            next_coord = self._best_successor(coord)
+        return next_coord
+    
+    def path_length(self, coord):
+        """ Get the number of steps from 'coord' to the nearest 
+            goal, or None if no goal can be reached.
+        """
+        if coord in self.goals:
+            return 0
+        if coord in self.distance:
+            return self.distance[coord]
+        
+        next_coord = self.get_next(coord)
+        if next_coord is None:
+            return None
+        return self.distance[next_coord] + 1
+
+# The per-query searches GridPath can be built with
+SEARCH_BACKENDS = {
+    'astar': FlatAStar,
+    'jps': JumpPointSearch,
+    'dial': DialSearch,
+}
+
 class GridPath(object):
     """ Represents the game grid and answers questions about 
         paths on this grid.
@@ -302,53 +1402,882 @@ class GridPath(object):
         information about the state of blocks on the grid, and
         get_next to get the next coordinate on the path to the 
         goal from a given coordinate.
+        
+        A goal is either a coordinate, or a frozenset of coordinates
+        (the squares of an exit, or of several exits) in which case 
+        the paths lead to the nearest of them. Every query takes an
+        optional goal, and uses the 'goal' of the GridPath if it's 
+        not given.
+        
+        All the paths to a goal lead to the same place, so the 
+        answers come from a DistanceField rooted at the goal, which
+        is kept for every goal asked about and shared by all the 
+        queries. Changes of the grid are repaired incrementally on 
+        the next query, and after that get_next, is_connected and 
+        path_length are O(1).
+        
+        would_disconnect answers "what if" questions about blocking
+        coordinates, without changing the grid.
+        
+        Many changes can be made at once with set_blocked_many, or in
+        a transaction(), which can also roll them back. The changes
+        of a transaction are passed on to the fields (and the rest of
+        the path data) once, when it ends or when it's queried.
+        
+        Alternatively, GridPath can be built with a per-query search
+        that computes the path from each start coord on demand. The
+        next coord of every coord on a computed path is cached, in a
+        table for the current state of the grid (its hash). The 
+        tables of the most recently used states are kept, so going
+        back to an earlier state (e.g. placing a tower and removing
+        it again) doesn't search again for the paths known then.
     """
-    def __init__(self, rows, cols, goal):
+    def __init__(self, rows, cols, goal, search=None, cache_entries=64,
+                 cache_bytes=16 * 1024 * 1024):
+        """ Create a new GridPath.
+        
+            search:
+                None to answer from DistanceFields, or the per-query
+                search to use: a name from SEARCH_BACKENDS ('astar',
+                'jps', 'dial'), or a function that receives the 
+                GridMap and returns an object with a 
+                compute_path(start, goal) method like PathFinder's 
+                (e.g. hpa.HierarchicalSearch). If the object also
+                has a set_blocked(coord, blocked) method, it is 
+                called whenever the grid changes.
+            
+            cache_entries, cache_bytes:
+                The limits of the LRUCache of path tables of the 
+                per-query search.
+        """
         self.map = GridMap(rows, cols)
         self.goal = goal
-
-        # Path cache. For a coord, keeps the next coord to move to in order to 
-        # reach the goal. Invalidated when the grid changes (with set_blocked)
-        self._path_cache = {}
+        
+        # DistanceFields by the frozenset of their goal coords
+        self._fields = {}
+        
+        self._search = None
+        if search is not None:
+            self._search = SEARCH_BACKENDS.get(search, search)(self.map)
+        
+        # Path tables of the per-query search, by (map hash, frozenset
+        # of the goal coords). For a coord, a table keeps the next 
+        # coord to move to in order to reach the goal and the length 
+        # of the path.
+        self._path_caches = LRUCache(cache_entries, cache_bytes)
+        
+        # Incremented on every change of the grid
+        self.version = 0
+        
+        # The previous blocked state of the coords changed since the
+        # path data was last told about the changes
+        self._pending = {}
+        # The (coord, previous blocked state) of every change of the
+        # open transaction, or None
+        self._undo = None
+        
+        # Routes (see _Route) by (start, goal coords), for the map
+        # hash of _routes_hash
+        self._routes = {}
+        self._routes_hash = 0
+        
+        # The (map hash, labels) of the walls (see _wall_labels)
+        self._walls = (None, None)
+        
+        # Buildable masks (see _BuildableMask) by (start, size, goal 
+        # coords)
+        self._masks = {}
+        
+        # Next hop and path length arrays (see next_hops) by goal 
+        # coords, as (map hash, array) pairs
+        self._next_hops = {}
+        self._path_lengths = {}
+        
+        # PathStats, or None if the stats are disabled
+        self.counters = None
+        
+        # The functions to call with the changes of the grid
+        self._listeners = []
     
-    def get_next(self, coord):
+    def _goal_coords(self, goal):
+        """ The frozenset of the coords of 'goal' (or of the goal of
+            the GridPath, if 'goal' is None)
+        """
+        if goal is None:
+            goal = self.goal
+        if isinstance(goal, frozenset):
+            return goal
+        return frozenset([goal])
+    
+    def _get_field(self, goal_coords):
+        self._flush()
+        field = self._fields.get(goal_coords)
+        if field is None:
+            field = self._fields[goal_coords] = DistanceField(self.map, 
+                                                              goal_coords)
+        if self.counters is None:
+            field.update()
+        else:
+            self._update_counted(field)
+        return field
+    
+    def _update_counted(self, field):
+        """ field.update(), counted in the PathStats
+        """
+        counters = self.counters
+        if field.valid and not field._changed:
+            counters.cache_hits += 1
+            return
+        
+        counters.cache_misses += 1
+        expansions = field.expansions
+        t = default_timer()
+        field.update()
+        counters.add_query(default_timer() - t, field.expansions - expansions)
+    
+    def get_next(self, coord, goal=None):
         """ Get the next coordinate to move to from 'coord' 
-            towards the goal.
+            towards the goal, or None if no path exists.
         """
-        # If the next path for this coord is not cached, compute it
-        if not (coord in self._path_cache):
-            self._compute_path(coord)
+        goal_coords = self._goal_coords(goal)
+        if self._search is not None:
+            return self._get_cached(coord, goal_coords)[0]
         
-        # _compute_path adds the path for the coord to the cache.
-        # If it's still not cached after the computation, it means
-        # that no path exists to the goal from this coord.
-        if coord in self._path_cache:
-            return self._path_cache[coord]
+        return self._get_field(goal_coords).get_next(coord)
+    
+    def is_connected(self, coord, goal=None):
+        """ Check if the goal can be reached from 'coord'
+        """
+        return self.get_next(coord, goal) is not None
+    
+    def path_length(self, coord, goal=None):
+        """ Get the number of steps from 'coord' to the goal, or
+            None if no path exists.
+        """
+        goal_coords = self._goal_coords(goal)
+        if self._search is not None:
+            return self._get_cached(coord, goal_coords)[1]
+        
+        return self._get_field(goal_coords).path_length(coord)
+    
+    def get_path(self, coord, goal=None):
+        """ Get the whole path from 'coord' to the goal as a list
+            of coordinates, including 'coord' and the goal. If no 
+            path exists, an empty list is returned.
+        """
+        if not self.is_connected(coord, goal):
+            return []
+        
+        goal_coords = self._goal_coords(goal)
+        path = [coord]
+        while not coord in goal_coords:
+            coord = self.get_next(coord, goal_coords)
+            path.append(coord)
+        return path
+    
+    def next_hops(self, goal=None):
+        """ Get the next coordinate of every coordinate at once, for
+            vectorized consumers: a rows X cols NumPy int32 array of
+            the linear index (row * cols + col) of the next 
+            coordinate to move to, or -1 where no path exists. The
+            goal coordinates point at themselves. Requires NumPy.
+            
+            The array is built once for each state of the grid and
+            shared by the callers, who must not modify it.
+        """
+        cols = self.map.cols
+        def next_index(coord, goal_coords):
+            next_coord = self.get_next(coord, goal_coords)
+            if next_coord is None:
+                return None
+            return next_coord[0] * cols + next_coord[1]
+        def from_field(field, values):
+            for (row, col), (next_row, next_col) in field.next.iteritems():
+                values[row * cols + col] = next_row * cols + next_col
+        return self._coord_array(goal, self._next_hops, next_index, 
+                                 from_field)
+    
+    def path_lengths(self, goal=None):
+        """ Get the path length of every coordinate at once, like
+            next_hops: a rows X cols NumPy int32 array of the number
+            of steps to the goal, or -1 where no path exists.
+        """
+        cols = self.map.cols
+        def from_field(field, values):
+            for (row, col), distance in field.distance.iteritems():
+                values[row * cols + col] = distance
+        return self._coord_array(goal, self._path_lengths, self.path_length,
+                                 from_field)
+    
+    def _coord_array(self, goal, cache, query, from_field):
+        """ The rows X cols array of the values of query(coord, goal
+            coords) (-1 for None), from the 'cache' dict if it is of
+            the current grid. The values of the coords of a field 
+            are filled in by from_field(field, values).
+            
+            In the PathStats, an array counts as a single query (and
+            cache hit or miss), not as one for each coord.
+        """
+        goal_coords = self._goal_coords(goal)
+        self._flush()
+        counters = self.counters
+        cached = cache.get(goal_coords)
+        if cached is not None and cached[0] == self.map.hash:
+            if counters is not None:
+                counters.cache_hits += 1
+            return cached[1]
+        
+        if counters is None:
+            return self._build_coord_array(goal_coords, cache, query, 
+                                           from_field)
+        counters.cache_misses += 1
+        expansions = self.expansions
+        t = default_timer()
+        self.counters = None
+        try:
+            values = self._build_coord_array(goal_coords, cache, query,
+                                             from_field)
+        finally:
+            self.counters = counters
+        counters.add_query(default_timer() - t, self.expansions - expansions)
+        return values
+    
+    def _build_coord_array(self, goal_coords, cache, query, from_field):
+        import numpy
+        rows, cols = self.map.rows, self.map.cols
+        values = numpy.empty(rows * cols, dtype=numpy.int32)
+        values.fill(-1)
+        if self._search is None:
+            from_field(self._get_field(goal_coords), values)
+            # The blocked coords aren't part of the field, but they
+            # may be next to it
+            coords = [(int(row), int(col)) for row, col in 
+                      zip(*numpy.nonzero(self.map.as_array()))]
+        else:
+            coords = ((row, col) for row in xrange(rows) 
+                                 for col in xrange(cols))
+        coords = itertools.chain(coords, (coord for coord in goal_coords 
+                                          if self.map.contains(coord)))
+        for coord in coords:
+            value = query(coord, goal_coords)
+            if value is not None:
+                values[coord[0] * cols + coord[1]] = value
+        
+        values = values.reshape(rows, cols)
+        cache[goal_coords] = (self.map.hash, values)
+        return values
+    
+    def _get_cached(self, coord, goal_coords):
+        """ The (next coord, path length) pair of 'coord' from the 
+            path table of the current grid, computed with the 
+            per-query search if needed.
+        """
+        self._flush()
+        key = (self.map.hash, goal_coords)
+        path_cache = self._path_caches.get(key)
+        if path_cache is None:
+            path_cache = {}
+        counters = self.counters
+        if coord in path_cache:
+            if counters is not None:
+                counters.cache_hits += 1
         else:
+            if counters is not None:
+                counters.cache_misses += 1
+                expansions = getattr(self._search, 'expansions', 0)
+                t = default_timer()
+            
+            # The path to the nearest of the goal coords
+            path_list = []
+            for goal in goal_coords:
+                path = list(self._search.compute_path(coord, goal))
+                if path and (not path_list or len(path) < len(path_list)):
+                    path_list = path
+            
+            if counters is not None:
+                counters.add_query(default_timer() - t, 
+                                   getattr(self._search, 'expansions', 0) - 
+                                   expansions)
+            
+            # Write the next coord of every coord on the whole path
+            # into the cache
+            for i, path_coord in enumerate(path_list):
+                next_i = i if i == len(path_list) - 1 else i + 1
+                path_cache[path_coord] = (path_list[next_i], 
+                                          len(path_list) - 1 - i)
+            
+            if not path_list:
+                path_cache[coord] = (None, None)
+            
+            # (Re)insert the table with its grown size: the dict and
+            # a tuple for each coord
+            self._path_caches.put(key, path_cache, 
+                                  sys.getsizeof(path_cache) + 
+                                  72 * len(path_cache))
+        
+        return path_cache[coord]
+    
+    @property
+    def expansions(self):
+        """ The number of nodes expanded so far by the fields and the
+            per-query search
+        """
+        total = sum(field.expansions for field in self._fields.itervalues())
+        if self._search is not None:
+            total += getattr(self._search, 'expansions', 0)
+        return total
+    
+    def enable_stats(self, enabled=True):
+        """ Start (or stop) keeping PathStats of the queries (and of
+            the per-query search, if it keeps them too). While 
+            disabled, they cost nothing.
+        """
+        if not enabled:
+            self.counters = None
+        elif self.counters is None:
+            self.counters = PathStats()
+        if hasattr(self._search, 'enable_stats'):
+            self._search.enable_stats(enabled)
+    
+    def stats(self, reset=False):
+        """ Get a snapshot of the PathStats as a dict (None if they
+            are disabled), and optionally reset them. The stats of 
+            the per-query search, if any, are under 'search'.
+        """
+        if self.counters is None:
             return None
+        stats = self.counters.snapshot(reset)
+        if hasattr(self._search, 'stats'):
+            stats['search'] = self._search.stats(reset)
+        return stats
+    
+    def cache_stats(self):
+        """ Get the statistics of the path tables of the per-query
+            search (see LRUCache.stats)
+        """
+        return self._path_caches.stats()
     
     def set_blocked(self, coord, blocked=True):
         """ Set the 'blocked' state of a coord
         """
+        self.set_blocked_many((coord,), blocked)
+    
+    def set_blocked_many(self, coords, blocked=True):
+        """ Set the 'blocked' state of all of 'coords'. The path data
+            is told about the changes once, after all of them are 
+            made. If one of the coords is outside of the map, an
+            IndexError is raised and nothing is changed.
+        """
+        coords = list(coords)
+        for coord in coords:
+            if not self.map.contains(coord):
+                raise IndexError("%s is outside of the map" % (coord,))
+        
+        for coord in coords:
+            was_blocked = self.map.is_blocked(coord)
+            if was_blocked != blocked:
+                self._apply(coord, blocked)
+                if self._undo is not None:
+                    self._undo.append((coord, was_blocked))
+        
+        if self._undo is None:
+            self._flush()
+    
+    def add_listener(self, listener):
+        """ Call 'listener' with the changes of the grid, a list of 
+            (coord, blocked) pairs, whenever they are passed on to 
+            the path data (after 'version' is incremented). 
+        """
+        self._listeners.append(listener)
+    
+    def remove_listener(self, listener):
+        self._listeners.remove(listener)
+    
+    def transaction(self):
+        """ Get a Transaction of the grid, to be used in a with 
+            statement:
+            
+                with gridpath.transaction() as transaction:
+                    gridpath.set_blocked(coord)
+                    ...
+                    if not gridpath.is_connected(start):
+                        transaction.rollback()
+            
+            The changes made in the with statement are rolled back if
+            it raises an exception.
+        """
+        return Transaction(self)
+    
+    def _apply(self, coord, blocked):
+        """ Change the map, and remember the change for _flush
+        """
+        if not coord in self._pending:
+            self._pending[coord] = self.map.is_blocked(coord)
         self.map.set_blocked(coord, blocked)
+    
+    def _flush(self):
+        """ Tell the path data about the pending changes. The coords 
+            that were changed back and forth are left out.
+        """
+        if not self._pending:
+            return
+        changed = [coord for coord, was_blocked in self._pending.iteritems()
+                   if self.map.is_blocked(coord) != was_blocked]
+        self._pending = {}
+        if not changed:
+            return
+        self.version += 1
+        if self.counters is not None:
+            self.counters.invalidations += 1
+        if self._listeners:
+            changes = [(coord, self.map.is_blocked(coord)) for coord in changed]
+            for listener in self._listeners:
+                listener(changes)
         
-        # Invalidate cache, because the map has changed
-        self._path_cache = {}
-
-    def _compute_path(self, coord):
-        pathfinder = PathFinder(self.map.successors, self.map.move_cost,
-                self.map.move_cost)
+        # The fields are repaired incrementally on the next query, 
+        # unless so much has changed that a new search is cheaper
+        for field in self._fields.itervalues():
+            if len(changed) > len(field.distance) // 4:
+                field.invalidate()
+            else:
+                for coord in changed:
+                    field.set_blocked(coord)
+        for mask in self._masks.itervalues():
+            mask.changed.update(changed)
+        if self._search is not None:
+            if hasattr(self._search, 'set_blocked'):
+                for coord in changed:
+                    self._search.set_blocked(coord, self.map.is_blocked(coord))
+    
+    def would_disconnect(self, coords, start, goal=None):
+        """ Check if blocking all of 'coords' would leave no path
+            from 'start' to the goal. The grid isn't changed.
+            
+            Most queries are answered by looking at the current path
+            from 'start' only: coords off the path can't disconnect
+            it, and neither can coords the path can locally detour 
+            around. A rectangle of free coords (e.g. a tower) across
+            the path is then checked as a whole, in O(size of the 
+            rectangle), by the walls around it (see _footprint_cut).
+            Otherwise, if one of the coords is a cut coord between 
+            'start' and the goal (a coord every path goes through),
+            the answer is True without a search.
+            
+            Only the remaining queries need a search of the grid, 
+            which is O(rows * cols) at worst: other shapes that no 
+            cut coord settles, a rectangle over 'start' or the goal 
+            on the path, one that may cut off some of the goal 
+            coords from the others, and the maps with diagonal 
+            moves.
+        """
+        coords = set(coords)
+        goal_coords = self._goal_coords(goal)
+        if goal_coords <= coords or not self.is_connected(start, goal_coords):
+            return True
+        
+        route = self._get_route(start, goal_coords)
+        hits = [route.positions[c] for c in coords if c in route.positions]
+        if not hits:
+            return False
+        
+        first, last = min(hits), max(hits)
+        if first > 0 and last < len(route.path) - 1:
+            if self._has_detour(route.path[first - 1], route.path[last + 1], 
+                                coords):
+                return False
+        
+        # A blocked start (or goal) isn't a free square, so the walls
+        # don't tell about it
+        if (first > 0 and last < len(route.path) - 1 and 
+            not self.map.is_blocked(start) and 
+            not self.map.is_blocked(route.path[-1])):
+            cut = self._footprint_cut(coords, route.path[first - 1],
+                                      route.path[last + 1], route.path[-1],
+                                      goal_coords)
+            if cut is not None:
+                return cut
         
-        # Get the whole path from coord to the goal into a list,
-        # and for each coord in the path write the next coord in
-        # the path into the path cache
-        path_list = list(pathfinder.compute_path(coord, self.goal))
+        # Nor is it a node of the graph of free coords, so the cut 
+        # coords don't apply to it
+        if first > 0 and not self.map.is_blocked(start):
+            if route.cut_coords is None:
+                route.cut_coords = self._find_cut_coords(start, goal_coords)
+            if not route.cut_coords.isdisjoint(coords):
+                return True
         
-        for i, path_coord in enumerate(path_list):
-            next_i = i if i == len(path_list) - 1 else i + 1
-            self._path_cache[path_coord] = path_list[next_i]
+        return not self._search_around(start, coords, goal_coords)
+    
+    def buildable_positions(self, start, size=2, goal=None):
+        """ Get the set of top-left coords where a size X size 
+            footprint can be blocked: all of its coords are on the 
+            map and free, and blocking them wouldn't disconnect 
+            'start' from the goal. The set must not be modified.
+            
+            The set is computed once and then kept up to date as 
+            the grid changes: after a change, only the positions 
+            overlapping the changed coords, or the old or the new 
+            path from 'start', are checked again. Any other position
+            is off both paths, so it can't have changed. Checking a
+            position is O(size * size) (see would_disconnect), 
+            besides labelling the walls once per state of the grid.
+        """
+        self._flush()
+        goal_coords = self._goal_coords(goal)
+        key = (start, size, goal_coords)
+        mask = self._masks.get(key)
+        if mask is None:
+            mask = self._masks[key] = _BuildableMask(start, size, goal_coords)
+            self._update_mask(mask, None)
+        elif mask.changed:
+            self._update_mask(mask, mask.changed)
+        return mask.positions
+    
+    def _update_mask(self, mask, changed):
+        path = set(self.get_path(mask.start, mask.goal_coords))
+        size = mask.size
+        max_row, max_col = self.map.rows - size, self.map.cols - size
+        
+        if changed is None or not path or not mask.path:
+            mask.positions = set()
+            candidates = ((row, col) for row in xrange(max_row + 1) 
+                                     for col in xrange(max_col + 1))
+        else:
+            candidates = set()
+            for row, col in path | mask.path | changed:
+                for top in xrange(max(row - size + 1, 0), min(row, max_row) + 1):
+                    for left in xrange(max(col - size + 1, 0), 
+                                       min(col, max_col) + 1):
+                        candidates.add((top, left))
+        
+        for top_left in candidates:
+            if self._can_block(top_left, size, mask.start, mask.goal_coords):
+                mask.positions.add(top_left)
+            else:
+                mask.positions.discard(top_left)
+        
+        mask.path = path
+        mask.changed = set()
+    
+    def _can_block(self, top_left, size, start, goal_coords):
+        top, left = top_left
+        coords = [(row, col) for row in xrange(top, top + size) 
+                             for col in xrange(left, left + size)]
+        for coord in coords:
+            if self.map.is_blocked(coord):
+                return False
+        return not self.would_disconnect(coords, start, goal_coords)
+    
+    def _get_route(self, start, goal_coords):
+        if self._routes_hash != self.map.hash:
+            self._routes = {}
+            self._routes_hash = self.map.hash
+        
+        key = (start, goal_coords)
+        if not key in self._routes:
+            self._routes[key] = _Route(self.get_path(start, goal_coords))
+        return self._routes[key]
+    
+    def _has_detour(self, source, target, coords):
+        """ Check if 'target' can be reached from 'source' without
+            passing 'coords', inside the bounding box of 'coords' 
+            grown by one coordinate on every side.
+        """
+        top = min(c[0] for c in coords) - 1
+        bottom = max(c[0] for c in coords) + 1
+        left = min(c[1] for c in coords) - 1
+        right = max(c[1] for c in coords) + 1
+        
+        visited = set([source])
+        frontier = [source]
+        while frontier:
+            coord = frontier.pop()
+            if coord == target:
+                return True
+            for succ in self.map.successors(coord):
+                if (top <= succ[0] <= bottom and left <= succ[1] <= right and
+                    not succ in coords and not succ in visited):
+                    visited.add(succ)
+                    frontier.append(succ)
+        return False
+    
+    def _wall_labels(self):
+        """ The labels of the walls of the current grid, by linear 
+            index (see GridMap.index): the blocked squares, and the
+            border around the map, are walls, and the walls that 
+            touch (also diagonally) have the same label. Free 
+            squares have no label (None).
+        """
+        if self._walls[0] == self.map.hash:
+            return self._walls[1]
+        
+        cells, stride = self.map.cells, self.map.stride
+        labels = [None] * len(cells)
+        parent = []
+        def find(label):
+            while parent[label] != label:
+                parent[label] = parent[parent[label]]
+                label = parent[label]
+            return label
+        
+        # Union-find over the walls, joining each to the walls before
+        # it: left, up-left, up and up-right
+        offsets = (-1, -stride - 1, -stride, -stride + 1)
+        for index in xrange(len(cells)):
+            if not cells[index]:
+                continue
+            label = None
+            col = index % stride
+            for offset in offsets:
+                other = index + offset
+                if (other < 0 or (offset != -stride and 
+                                  abs(other % stride - col) > 1)):
+                    continue
+                other_label = labels[other]
+                if other_label is None:
+                    continue
+                other_label = find(other_label)
+                if label is None:
+                    label = other_label
+                elif other_label != label:
+                    parent[other_label] = label
+            if label is None:
+                label = len(parent)
+                parent.append(label)
+            labels[index] = label
+        for index in xrange(len(cells)):
+            if labels[index] is not None:
+                labels[index] = find(labels[index])
+        
+        self._walls = (self.map.hash, labels)
+        return labels
+    
+    def _footprint_cut(self, coords, before, after, goal, goal_coords):
+        """ Check if blocking 'coords' would cut the path through
+            them, from 'before' (the coord before them on the path
+            from the start) to 'after' (the coord after them) and on
+            to 'goal', off from the goal coords. Returns None if it
+            can't tell cheaply: 
+            'coords' must be a rectangle of free coords, and the 
+            moves must be to the 4 neighbors.
+            
+            The walls (see _wall_labels) and the free squares are 
+            dual: the free squares around the rectangle are split
+            apart by blocking it only where the rectangle joins a 
+            wall to itself, closing a loop. So the frame of squares
+            around the rectangle is split into arcs of walls and of
+            free squares, and two free arcs stay connected unless 
+            the same wall is on both sides between them.
+        """
+        if self.map.diagonal:
+            return None
+        top = min(row for row, col in coords)
+        bottom = max(row for row, col in coords)
+        left = min(col for row, col in coords)
+        right = max(col for row, col in coords)
+        if len(coords) != (bottom - top + 1) * (right - left + 1):
+            return None
+        for coord in coords:
+            if self.map.is_blocked(coord):
+                return None
+        
+        # The frame, clockwise from the top-left corner
+        frame = ([(top - 1, col) for col in xrange(left - 1, right + 1)] +
+                 [(row, right + 1) for row in xrange(top - 1, bottom + 1)] +
+                 [(bottom + 1, col) for col in xrange(right + 1, left - 1, -1)] +
+                 [(row, left - 1) for row in xrange(bottom + 1, top - 1, -1)])
+        labels = self._wall_labels()
+        index = self.map.index
+        walls = [labels[index(coord)] for coord in frame]
+        if all(wall is None for wall in walls):
+            return False
+        
+        # A free corner between two walls doesn't touch the rectangle,
+        # and the walls touch diagonally: it's part of the wall
+        corners = set([(top - 1, left - 1), (top - 1, right + 1),
+                       (bottom + 1, left - 1), (bottom + 1, right + 1)])
+        count = len(frame)
+        for i, coord in enumerate(frame):
+            if (coord in corners and walls[i] is None and 
+                walls[i - 1] is not None and 
+                walls[(i + 1) % count] is not None):
+                walls[i] = walls[i - 1]
+        
+        # The wall and free arcs, alternating, starting with a wall
+        # arc: the label of each wall arc, and the free arc of each 
+        # free coord
+        start = [i for i in xrange(count) if walls[i] is not None][0]
+        wall_arcs = []
+        free_arc = {}
+        for i in xrange(start, start + count):
+            wall = walls[i % count]
+            if wall is not None:
+                if i == start or walls[(i - 1) % count] is None:
+                    wall_arcs.append(wall)
+            else:
+                free_arc[frame[i % count]] = len(wall_arcs) - 1
+        
+        # The free arcs i < j are apart if a wall is both among the 
+        # wall arcs between them and among the other ones
+        i, j = sorted((free_arc[before], free_arc[after]))
+        if i != j:
+            between = set(wall_arcs[i + 1:j + 1])
+            if not between.isdisjoint(wall_arcs[j + 1:] + wall_arcs[:i + 1]):
+                # The goal coord reached from 'after' is on the other
+                # side, and so are the goal coords connected to it 
+                # (outside the rectangle); the others may not be
+                reached = set([goal])
+                frontier = [goal]
+                while frontier:
+                    row, col = frontier.pop()
+                    for coord in ((row - 1, col), (row, col - 1), 
+                                  (row, col + 1), (row + 1, col)):
+                        if (coord in goal_coords and not coord in reached and
+                            not coord in coords and 
+                            not self.map.is_blocked(coord)):
+                            reached.add(coord)
+                            frontier.append(coord)
+                if all(coord in reached or coord in coords or 
+                       self.map.is_blocked(coord) for coord in goal_coords):
+                    return True
+                return None
+        return False
+    
+    def _find_cut_coords(self, start, goal_coords):
+        """ Find the coords that are on every path from 'start' to 
+            the goal coords: the articulation points of the free 
+            coords that separate 'start' from all of the goal coords
+            (iterative Tarjan).
+        """
+        successors = self.map.successors
+        
+        order = {start: 0}
+        low = {start: 0}
+        parent = {start: None}
+        # The number of goal coords in the DFS subtree of each coord,
+        # and in the subtrees each coord separates from the start
+        goals_below = {start: 1 if start in goal_coords else 0}
+        goals_cut = {}
+        
+        stack = [(start, iter(successors(start)))]
+        while stack:
+            coord, succs = stack[-1]
+            for succ in succs:
+                if not succ in order:
+                    order[succ] = low[succ] = len(order)
+                    parent[succ] = coord
+                    goals_below[succ] = 1 if succ in goal_coords else 0
+                    stack.append((succ, iter(successors(succ))))
+                    break
+                elif succ != parent[coord] and order[succ] < low[coord]:
+                    low[coord] = order[succ]
+            else:
+                stack.pop()
+                pred = parent[coord]
+                if pred is None:
+                    continue
+                if low[coord] < low[pred]:
+                    low[pred] = low[coord]
+                goals_below[pred] += goals_below[coord]
+                if low[coord] >= order[pred]:
+                    goals_cut[pred] = goals_cut.get(pred, 0) + goals_below[coord]
+        
+        # Blocking a coord disconnects the start if all of the 
+        # reachable goal coords are either separated by it, or it 
+        # itself
+        total = goals_below[start]
+        return set(coord for coord, count in goals_cut.iteritems()
+                   if coord != start and 
+                      count + (coord in goal_coords) == total)
+    
+    def _search_around(self, start, coords, goal_coords):
+        """ Check if the goal can be reached from 'start' without 
+            passing 'coords'. A best-first search, guided by the 
+            distances of the current field (or by the Manhattan 
+            distance when there's no field).
+        """
+        if self.counters is not None:
+            self.counters.disconnect_searches += 1
+        if self._search is None:
+            # Coords that can't reach the goal now (with no distance)
+            # won't reach it with even more blocks
+            estimate = self._get_field(goal_coords).distance.get
+        else:
+            estimate = lambda coord: min(
+                abs(coord[0] - goal[0]) + abs(coord[1] - goal[1])
+                for goal in goal_coords)
+        
+        visited = set([start])
+        frontier = [(estimate(start) or 0, start)]
+        while frontier:
+            dist, coord = heapq.heappop(frontier)
+            if coord in goal_coords:
+                return True
+            for succ in self.map.successors(coord):
+                if succ in coords or succ in visited:
+                    continue
+                succ_dist = estimate(succ)
+                if succ_dist is not None:
+                    visited.add(succ)
+                    heapq.heappush(frontier, (succ_dist, succ))
+        return False
+
+class Transaction(object):
+    """ A group of changes of the grid of a GridPath, see 
+        GridPath.transaction. Transactions can be nested; rolling 
+        back an inner one only undoes the changes made in it.
+    """
+    def __init__(self, gridpath):
+        self.gridpath = gridpath
+        self._outer_undo = None
+        self._mark = 0
+    
+    def __enter__(self):
+        gridpath = self.gridpath
+        self._outer_undo = gridpath._undo
+        if gridpath._undo is None:
+            gridpath._undo = []
+        self._mark = len(gridpath._undo)
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is not None:
+            self.rollback()
+        if self._outer_undo is None:
+            self.gridpath._undo = None
+            self.gridpath._flush()
+        return False
+    
+    def rollback(self):
+        """ Undo the changes made in the transaction so far
+        """
+        undo = self.gridpath._undo
+        while len(undo) > self._mark:
+            coord, was_blocked = undo.pop()
+            self.gridpath._apply(coord, was_blocked)
+
+class _BuildableMask(object):
+    """ The buildable positions of a size X size footprint, for 
+        paths from a start coord to a goal. 'path' is the set of 
+        coords on the path the positions were computed with, and 
+        'changed' the set of coords changed since then.
+    """
+    def __init__(self, start, size, goal_coords):
+        self.start = start
+        self.size = size
+        self.goal_coords = goal_coords
+        self.positions = set()
+        self.path = set()
+        self.changed = set()
 
-        return path_list
+class _Route(object):
+    """ A path from a start coord to a goal of a GridPath, with
+        the position of every coord on it, and the cut coords 
+        between the start and the goal (computed on demand).
+    """
+    def __init__(self, path):
+        self.path = path
+        self.positions = dict((coord, i) for i, coord in enumerate(path))
+        self.cut_coords = None
 
 if __name__ == "__main__":        
     # test the pathfinder
@@ -375,3 +2304,30 @@ if __name__ == "__main__":
     print path
     if len(path) == 0:
         print "Blocking!"
+    
+    # The buildable positions of a 2x2 tower on a 100x100 map of 2-wide
+    # serpentine corridors: every position across a corridor is a cut,
+    # and must be found without searching the grid for each of them
+    size = 100
+    gridpath = GridPath(size, size, (size - 1, 0))
+    walls = []
+    for i, row in enumerate(xrange(2, size - 1, 3)):
+        gap = (size - 2, size - 1) if i % 2 == 0 else (0, 1)
+        walls.extend((row, col) for col in xrange(size) if not col in gap)
+    gridpath.set_blocked_many(walls)
+    gridpath.enable_stats()
+    
+    t = time.clock()
+    positions = gridpath.buildable_positions((0, 0))
+    searches = gridpath.stats(reset=True)['disconnect_searches']
+    print "Buildable: %d positions, %d searches, %ss" % (
+        len(positions), searches, time.clock() - t)
+    assert not positions and searches <= 4
+    
+    t = time.clock()
+    gridpath.set_blocked((0, size / 2))
+    positions = gridpath.buildable_positions((0, 0))
+    searches = gridpath.stats(reset=True)['disconnect_searches']
+    print "After an edit: %d positions, %d searches, %ss" % (
+        len(positions), searches, time.clock() - t)
+    assert not positions and searches <= 4
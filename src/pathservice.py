@@ -0,0 +1,194 @@
+'''
+Path service.
+
+Answers path queries in a background thread, so that a slow search
+never stalls a frame.
+'''
+
+import threading
+
+from Queue import Queue
+
+from pathfinder import GridPath
+
+class PathFuture(object):
+    """ The answer to a query of a PathService, which becomes 
+        available later.
+
+        'version' is the version of the GridPath the query was made
+        for. If the grid has changed by the time the query is 
+        answered, the answer is dropped: the future is done, but 
+        'stale' and without a result.
+    """
+    def __init__(self, version):
+        self.version = version
+        self.stale = False
+        self._result = None
+        self._exception = None
+        self._done = threading.Event()
+
+    def done(self):
+        """ Check if the query has been answered (or dropped)
+        """
+        return self._done.is_set()
+
+    def result(self, timeout=None):
+        """ Get the answer to the query, waiting up to 'timeout'
+            seconds for it (forever if None). Returns None if the 
+            answer was dropped (see 'stale') or isn't there yet.
+            Raises the exception of the query if it failed.
+        """
+        self._done.wait(timeout)
+        if self._exception is not None:
+            raise self._exception
+        return self._result
+
+    def _set_result(self, result):
+        self._result = result
+        self._done.set()
+
+    def _set_exception(self, exception):
+        self._exception = exception
+        self._done.set()
+
+    def _set_stale(self):
+        self.stale = True
+        self._done.set()
+
+class PathService(object):
+    """ Answers the queries of a GridPath (get_next, path_length, 
+        get_path, next_hops, path_lengths, would_disconnect and 
+        buildable_positions) in a worker thread. A query returns
+        a PathFuture at once; only its result() waits for the 
+        answer, so a caller that mustn't wait checks done() first 
+        (e.g. the game holds its ticks back until the next hops it
+        needs are done, see Engine.ready).
+
+        The worker keeps its own copy of the GridPath, and follows 
+        the changes of the original one (it listens to them), so the
+        original stays usable from the main thread. The queries of 
+        a version of the grid are made once: asking again returns 
+        the same future.
+    """
+    def __init__(self, gridpath, search=None):
+        """ Create a new PathService and start its worker.
+
+            search:
+                The per-query search of the worker's GridPath (see
+                GridPath), None for distance fields.
+        """
+        self.gridpath = gridpath
+        self._requests = Queue()
+        # The futures of the current version, by (kind, goal, args)
+        self._futures = {}
+        self._futures_version = gridpath.version
+
+        gridmap = gridpath.map
+        replica = GridPath(gridmap.rows, gridmap.cols, gridpath.goal, search)
+        replica.set_blocked_many((row, col) for row in xrange(gridmap.rows)
+                                            for col in xrange(gridmap.cols)
+                                            if gridmap.is_blocked((row, col)))
+        gridpath.add_listener(self._grid_changed)
+
+        self._thread = threading.Thread(target=self._run, args=(replica,))
+        self._thread.daemon = True
+        self._thread.start()
+
+    def get_next(self, coord, goal=None):
+        """ Query the next coordinate to move to from 'coord'
+            (see GridPath.get_next)
+        """
+        return self._request('get_next', goal, coord)
+
+    def path_length(self, coord, goal=None):
+        """ Query the number of steps from 'coord' to the goal
+            (see GridPath.path_length)
+        """
+        return self._request('path_length', goal, coord)
+
+    def get_path(self, coord, goal=None):
+        """ Query the whole path from 'coord' to the goal (see 
+            GridPath.get_path)
+        """
+        return self._request('get_path', goal, coord)
+
+    def next_hops(self, goal=None):
+        """ Query the next coordinate of every coordinate at once
+            (see GridPath.next_hops)
+        """
+        return self._request('next_hops', goal)
+
+    def path_lengths(self, goal=None):
+        """ Query the path length of every coordinate at once (see
+            GridPath.path_lengths)
+        """
+        return self._request('path_lengths', goal)
+
+    def would_disconnect(self, coords, start, goal=None):
+        """ Query if blocking 'coords' would leave no path from 
+            'start' to the goal (see GridPath.would_disconnect)
+        """
+        return self._request('would_disconnect', goal, frozenset(coords),
+                             start)
+
+    def buildable_positions(self, start, size=2, goal=None):
+        """ Query the top-left coords where a size X size footprint
+            can be blocked (see GridPath.buildable_positions)
+        """
+        return self._request('buildable_positions', goal, start, size)
+
+    def close(self):
+        """ Stop the worker (after the queries made so far)
+        """
+        self.gridpath.remove_listener(self._grid_changed)
+        self._requests.put(None)
+        self._thread.join()
+
+    def _request(self, kind, goal, *args):
+        if goal is None:
+            goal = self.gridpath.goal
+        version = self.gridpath.version
+        if version != self._futures_version:
+            self._futures = {}
+            self._futures_version = version
+
+        key = (kind, goal) + args
+        future = self._futures.get(key)
+        if future is None:
+            future = self._futures[key] = PathFuture(version)
+            self._requests.put((kind, args + (goal,), future))
+        return future
+
+    def _grid_changed(self, changes):
+        # The changes are queued before any query of the new version,
+        # so the worker's grid is always at the version of the query
+        # it answers
+        self._requests.put(('changes', changes))
+
+    def _run(self, replica):
+        while True:
+            request = self._requests.get()
+            if request is None:
+                return
+            if request[0] == 'changes':
+                with replica.transaction():
+                    for coord, blocked in request[1]:
+                        replica.set_blocked(coord, blocked)
+                continue
+
+            kind, args, future = request
+            if future.version != self.gridpath.version:
+                future._set_stale()
+                continue
+            try:
+                result = getattr(replica, kind)(*args)
+            except Exception as e:
+                future._set_exception(e)
+                continue
+            if isinstance(result, set):
+                # The worker's GridPath keeps updating its sets
+                result = frozenset(result)
+            if future.version != self.gridpath.version:
+                future._set_stale()
+            else:
+                future._set_result(result)
@@ -0,0 +1,152 @@
+'''
+Projectiles.
+
+The shots of the turrets (see combat), flying until they hit a creep.
+'''
+
+import numpy
+
+import pygame
+from shared import TILE_SIZE, FIELD_RECT, SUBPIXELS
+
+def projectile_image(radius=2):
+    """ The image of a projectile, shared by all of them
+    """
+    surface = pygame.Surface((2*radius+1, 2*radius+1))
+    surface.fill((0,0,0))
+    pygame.draw.circle(surface, (255,80,80), (radius, radius), radius)
+    surface.set_colorkey((0,0,0))
+    return surface
+
+class Projectiles(object):
+    """ A pool of up to 'capacity' projectiles, simulated together.
+
+        The state of the projectiles is kept in NumPy arrays of the
+        size of the pool, and the free slots on a stack, so firing
+        a shot only writes into the arrays. Every update (a tick)
+        moves all of them in a straight line, and tests them against
+        the creeps around them at once, through a SpatialHash: a
+        projectile hits the nearest creep within 'hit_radius'
+        pixels, and is gone. Projectiles that fly out of the field
+        or for too long are gone too.
+
+        pos:
+            The (x, y) positions, in 1/SUBPIXELS of a pixel
+        velocity:
+            The (dx, dy) moves per tick, in 1/SUBPIXELS of a pixel
+        damage:
+            The health taken from the creep hit
+        ttl:
+            The ticks left to fly
+        alive:
+            The slots in use
+    """
+    def __init__(self, capacity=1024, hit_radius=TILE_SIZE/2):
+        self.capacity = capacity
+        self.hit_radius = hit_radius * SUBPIXELS
+        self.pos = numpy.zeros((capacity, 2), dtype=numpy.int64)
+        self.velocity = numpy.zeros((capacity, 2), dtype=numpy.int64)
+        self.damage = numpy.zeros(capacity, dtype=numpy.int64)
+        self.ttl = numpy.zeros(capacity, dtype=numpy.int64)
+        self.alive = numpy.zeros(capacity, dtype=bool)
+        # The free slots are free[:free_count]
+        self._free = numpy.arange(capacity - 1, -1, -1)
+        self._free_count = capacity
+
+    def __len__(self):
+        """ The number of projectiles in flight
+        """
+        return self.capacity - self._free_count
+
+    def fire(self, origin, target, step, damage, distance):
+        """ Fire a projectile from 'origin' towards 'target', moving
+            'step' per tick, up to 'distance' (all in 1/SUBPIXELS of
+            a pixel; 'step' must be less than the hit radius, so that
+            no creep is jumped over). Returns its slot, or -1 if the
+            pool is full (and the shot is lost).
+        """
+        if not self._free_count:
+            return -1
+        self._free_count -= 1
+        index = self._free[self._free_count]
+
+        dx, dy = target[0] - origin[0], target[1] - origin[1]
+        length = max((dx * dx + dy * dy) ** 0.5, 1)
+        self.pos[index] = origin
+        self.velocity[index] = (int(round(dx * step / length)),
+                                int(round(dy * step / length)))
+        self.damage[index] = damage
+        self.ttl[index] = distance // step + 1
+        self.alive[index] = True
+        return index
+
+    def _release(self, index):
+        self.alive[index] = False
+        count = self._free_count
+        self._free[count:count + len(index)] = index
+        self._free_count = count + len(index)
+
+    def update(self, swarm, grid):
+        """ Move all the projectiles for a tick, and hit the creeps
+            of 'swarm' (bucketed in the SpatialHash 'grid'). Returns
+            the (creep indices, damages) arrays of the hits; a creep
+            may be hit more than once.
+        """
+        index = numpy.flatnonzero(self.alive)
+        if not len(index):
+            return index, index
+        pos = self.pos[index] + self.velocity[index]
+        self.pos[index] = pos
+        self.ttl[index] -= 1
+
+        size = TILE_SIZE * SUBPIXELS
+        col = (pos[:, 0] - FIELD_RECT.left * SUBPIXELS) // size
+        row = (pos[:, 1] - FIELD_RECT.top * SUBPIXELS) // size
+        gone = ((self.ttl[index] <= 0) | (row < 0) | (row >= grid.rows) |
+                (col < 0) | (col >= grid.cols))
+        self._release(index[gone])
+        index, pos, row, col = (index[~gone], pos[~gone], row[~gone],
+                                col[~gone])
+        if not len(index) or not len(swarm):
+            return index[:0], index[:0]
+
+        # The creeps of the 3 X 3 squares around each projectile, as
+        # (projectile, creep) pairs
+        grid.rebuild(swarm)
+        projectile, cell = [], []
+        for d_row in (-1, 0, 1):
+            for d_col in (-1, 0, 1):
+                n_row, n_col = row + d_row, col + d_col
+                inside = ((n_row >= 0) & (n_row < grid.rows) &
+                          (n_col >= 0) & (n_col < grid.cols))
+                projectile.append(numpy.flatnonzero(inside))
+                cell.append(n_row[inside] * grid.cols + n_col[inside])
+        projectile = numpy.concatenate(projectile)
+        cell = numpy.concatenate(cell)
+        counts = grid.start[cell + 1] - grid.start[cell]
+        total = counts.sum()
+        if not total:
+            return index[:0], index[:0]
+        ends = numpy.cumsum(counts)
+        first = numpy.repeat(grid.start[cell] - (ends - counts), counts)
+        creep = grid.order[first + numpy.arange(total)]
+        projectile = numpy.repeat(projectile, counts)
+
+        offset = pos[projectile] - swarm.pos[creep]
+        distance = (offset * offset).sum(axis=1)
+        near = distance <= self.hit_radius * self.hit_radius
+        projectile, creep, distance = (projectile[near], creep[near],
+                                       distance[near])
+
+        # The nearest creep of each projectile (the lowest index of
+        # the nearest ones)
+        order = numpy.lexsort((creep, distance, projectile))
+        projectile, creep = projectile[order], creep[order]
+        nearest = numpy.ones(len(projectile), dtype=bool)
+        nearest[1:] = projectile[1:] != projectile[:-1]
+        projectile, creep = projectile[nearest], creep[nearest]
+
+        hit = index[projectile]
+        damage = self.damage[hit]
+        self._release(hit)
+        return creep, damage
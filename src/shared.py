@@ -6,10 +6,15 @@ Shared.
 
 import operator
 from pygame import Rect
+import heapq
 import math
 
 TILE_SIZE = 20
 FIELD_RECT = Rect(0,0,TILE_SIZE*20,TILE_SIZE*18)
+# The duration of a simulation tick, in milliseconds
+TICK_TIME = 10
+# The fixed point positions are in 1/SUBPIXELS of a pixel
+SUBPIXELS = 256
 
 def xy2coord(pos):
     """ Convert a (x, y) pair to a (row, col) coordinate
@@ -35,7 +40,10 @@ class Timer(object):
         in milliseconds.
         
         The callback calls will result synchronously during these
-        calls to update()
+        calls to update(), once for every interval passed (so an 
+        update of several intervals catches up on all of them).
+        
+        To run many timers, use a Scheduler instead.
     """
     def __init__(self, interval, callback, oneshot=False):
         """ Create a new Timer.
@@ -55,13 +63,267 @@ class Timer(object):
             return
             
         self.time += time_passed
-        if self.time > self.interval:
+        while self.alive and self.time >= self.interval:
             self.time -= self.interval
             self.callback()
             
             if self.oneshot:
                 self.alive = False
  
+class ScheduledCall(object):
+    """ A call of a Scheduler, which can be cancelled
+    """
+    __slots__ = ['due', 'seq', 'callback', 'interval', 'scheduler', 
+                 'cancelled']
+    
+    def __init__(self, due, seq, callback, interval, scheduler):
+        self.due = due
+        self.seq = seq
+        self.callback = callback
+        self.interval = interval
+        self.scheduler = scheduler
+        self.cancelled = False
+    
+    def cancel(self):
+        """ Don't make the call (any more)
+        """
+        if not self.cancelled:
+            self.cancelled = True
+            self.scheduler._count -= 1
+
+class Scheduler(object):
+    """ Calls functions at given times, in milliseconds since the 
+        Scheduler was created. Its owner advances the time (e.g. once
+        per tick), and the calls that are due are made then, in the 
+        order of their times (and of scheduling, for equal times). 
+        If the time advances by several intervals of a repeating 
+        call, the call is made for each of them: the calls catch up,
+        and never drift.
+        
+        The calls are kept in a hierarchical timing wheel: WHEELS 
+        wheels of SLOTS slots, where a slot of the first wheel holds
+        the calls due within 'resolution' ms, and a slot of each 
+        next wheel covers a whole turn of the previous one. A call 
+        is put in the slot of the first wheel its time differs from
+        the current time in; when the time gets to a slot of a 
+        higher wheel, its calls are spread over the lower wheels. 
+        Scheduling and cancelling a call are O(1), and advancing 
+        skips the empty slots, and costs O(1) per call made (or 
+        spread).
+    """
+    SLOT_BITS = 6
+    SLOTS = 1 << SLOT_BITS
+    WHEELS = 4
+    
+    def __init__(self, resolution=1):
+        """ Create a new Scheduler.
+        
+            resolution: The time (ms) covered by a slot of the first
+                wheel; the time the owner advances by, ideally.
+        """
+        self.resolution = resolution
+        self.time = 0
+        # The slot of the first wheel that was made last, in units
+        # of 'resolution'. The calls of the earlier slots are done.
+        self._slot = 0
+        self._wheels = [[[] for slot in xrange(self.SLOTS)] 
+                        for wheel in xrange(self.WHEELS)]
+        # The calls due beyond the last wheel
+        self._overflow = []
+        # The time advanced to, and the calls due by then while they
+        # are being made
+        self._until = 0
+        self._due = None
+        self._seq = 0
+        self._count = 0
+    
+    def __len__(self):
+        """ The number of calls to make (a repeating call counts 
+            once)
+        """
+        return self._count
+    
+    def schedule(self, delay, callback, interval=None):
+        """ Call 'callback' in 'delay' ms, and then every 'interval'
+            ms, if given (until cancelled). Returns the ScheduledCall.
+        """
+        if interval is not None and interval <= 0:
+            raise ValueError("the interval must be positive")
+        call = ScheduledCall(self.time + max(delay, 0), self._seq, callback,
+                             interval, self)
+        self._seq += 1
+        self._count += 1
+        self._insert(call)
+        return call
+    
+    def _insert(self, call):
+        slot = call.due // self.resolution
+        if slot <= self._slot:
+            if self._due is not None and call.due <= self._until:
+                heapq.heappush(self._due, (call.due, call.seq, call))
+            else:
+                self._wheels[0][self._slot & (self.SLOTS - 1)].append(call)
+            return
+        
+        # The first wheel the slot differs from the current one in
+        differ = slot ^ self._slot
+        for wheel in xrange(self.WHEELS):
+            differ >>= self.SLOT_BITS
+            if not differ:
+                index = (slot >> (wheel * self.SLOT_BITS)) & (self.SLOTS - 1)
+                self._wheels[wheel][index].append(call)
+                return
+        self._overflow.append(call)
+    
+    def advance(self, time_passed):
+        """ Advance the time by 'time_passed' ms, and make the calls
+            due by then. While a call is made, 'time' is the time it
+            was due at.
+        """
+        self._until = until = self.time + time_passed
+        last = until // self.resolution
+        while self._count:
+            self._run_slot()
+            if self._slot >= last:
+                break
+            self._slot = min(self._next_slot(), last)
+            self._cascade()
+        self._slot = max(self._slot, last)
+        self.time = until
+    
+    def _next_slot(self):
+        """ The next slot of the first wheel with calls in it, or 
+            with calls to spread from a higher wheel: the calls of a
+            wheel are all in the slots after the current one
+        """
+        slot = self._slot
+        for wheel in xrange(self.WHEELS):
+            shift = wheel * self.SLOT_BITS
+            index = (slot >> shift) & (self.SLOTS - 1)
+            slots = self._wheels[wheel]
+            for next_index in xrange(index + 1, self.SLOTS):
+                if slots[next_index]:
+                    return ((slot >> shift) + next_index - index) << shift
+        shift = self.WHEELS * self.SLOT_BITS
+        return ((slot >> shift) + 1) << shift
+    
+    def _cascade(self):
+        """ Spread the calls of the higher wheels whose slots start
+            at the current slot, highest first
+        """
+        slot = self._slot
+        wheel = 0
+        while (wheel + 1 < self.WHEELS and 
+               not slot & ((1 << ((wheel + 1) * self.SLOT_BITS)) - 1)):
+            wheel += 1
+        if (wheel == self.WHEELS - 1 and 
+            not slot & ((1 << (self.WHEELS * self.SLOT_BITS)) - 1)):
+            calls, self._overflow = self._overflow, []
+            self._reinsert(calls)
+        for wheel in xrange(wheel, 0, -1):
+            index = (slot >> (wheel * self.SLOT_BITS)) & (self.SLOTS - 1)
+            calls = self._wheels[wheel][index]
+            self._wheels[wheel][index] = []
+            self._reinsert(calls)
+    
+    def _reinsert(self, calls):
+        for call in calls:
+            if not call.cancelled:
+                self._insert(call)
+    
+    def _run_slot(self):
+        """ Make the calls of the current slot that are due
+        """
+        index = self._slot & (self.SLOTS - 1)
+        calls = self._wheels[0][index]
+        if not calls:
+            return
+        self._wheels[0][index] = later = []
+        self._due = due = []
+        for call in calls:
+            if call.cancelled:
+                continue
+            if call.due <= self._until:
+                due.append((call.due, call.seq, call))
+            else:
+                later.append(call)
+        heapq.heapify(due)
+        try:
+            while due:
+                time, seq, call = heapq.heappop(due)
+                if call.cancelled:
+                    continue
+                if call.interval is None:
+                    call.cancelled = True
+                    self._count -= 1
+                else:
+                    call.due += call.interval
+                    call.seq = self._seq
+                    self._seq += 1
+                    self._insert(call)
+                self.time = max(self.time, time)
+                call.callback()
+        finally:
+            self._due = None
+
+class FixedStep(object):
+    """ Runs a simulation in ticks of a fixed duration, whatever
+        the duration of the frames.
+        
+        After creation, call advance() once per frame with the time
+        passed since the previous frame in milliseconds. The time is
+        accumulated, and the callback is called once for every whole
+        tick of it (none, one or several per frame); the rest is
+        carried over to the next frame. So the simulation runs the 
+        same, tick by tick, at any frame rate.
+        
+        A tick can be held back: if 'ready' says it isn't, it (and
+        the ones after it) are left for the next advance(), so the 
+        frame goes on (e.g. handling the input and drawing) instead
+        of waiting.
+    """
+    def __init__(self, tick, callback, max_ticks=10, ready=None):
+        """ Create a new FixedStep.
+        
+            tick: The duration of a tick in milliseconds
+            callback: Callable, called with 'tick' for each tick
+            max_ticks: The most ticks run by an advance() (times 
+                the speed). The time of the ticks over it is 
+                dropped, so that a slow machine slows the game down
+                instead of falling further and further behind.
+            ready: Callable, telling if the next tick can run, or
+                None if they always can
+        """
+        self.tick = tick
+        self.callback = callback
+        self.max_ticks = max_ticks
+        self.ready = ready
+        # The simulated ms per real ms; more than 1 to fast-forward
+        self.speed = 1
+        # The accumulated time not simulated yet
+        self.time = 0
+        # The number of ticks run so far
+        self.ticks = 0
+    
+    def advance(self, time_passed):
+        """ Run the ticks of 'time_passed' ms (and of the time left
+            over by the previous calls). Returns the number of ticks
+            run.
+        """
+        self.time += time_passed * self.speed
+        max_ticks = self.max_ticks * self.speed
+        if self.time // self.tick > max_ticks:
+            self.time = max_ticks * self.tick + self.time % self.tick
+        ticks = 0
+        while self.time >= self.tick:
+            if self.ready is not None and not self.ready():
+                break
+            self.callback(self.tick)
+            self.time -= self.tick
+            self.ticks += 1
+            ticks += 1
+        return ticks
+
 class Vector2D(object):
     """2d vector class, supports vector and scalar operators,
        and also provides a bunch of high level functions
@@ -6,58 +6,46 @@ Tower Defence.
 
 import pygame
 from sys import exit
-from pathfinder import GridPath
+import engine
+from engine import Engine, BUILD_TIME
 from towers import Block, Tower
-from creep import Creep
-from shared import TILE_SIZE, FIELD_RECT, xy2coord, coord2xy_mid, Vector2D as v
-from random import randint
+from creep import CreepSprite, creep_image
+from projectiles import projectile_image
+from shared import TILE_SIZE, FIELD_RECT, TICK_TIME, SUBPIXELS, FixedStep, \
+                   xy2coord, Vector2D as v
 
-class Player(object):
-    def __init__(self):
-        self.money = 0
-        self.stuns = 0
-
-class Field(pygame.surface.Surface, GridPath):
+class Field(pygame.surface.Surface, engine.Field):
+    """ A Field that draws itself
+    """
     def __init__(self):
         pygame.Surface.__init__(self, FIELD_RECT.bottomright)
+        engine.Field.__init__(self, FIELD_RECT)
         self.convert()
         self.show_grid = True
+        self.show_buildable = False
         self.fill((100,100,100))
-        self.bounds = self.get_rect()
-        # define the entrance
-        self.entrance = pygame.Rect(self.bounds.left+9*TILE_SIZE, self.bounds.top, 
-                                    2*TILE_SIZE, TILE_SIZE)
-        # define the exit
-        self.exit = pygame.Rect(self.bounds.right-11*TILE_SIZE, 
-                                self.bounds.bottom-TILE_SIZE,
-                                2*TILE_SIZE,TILE_SIZE)
-        
-        # Create the grid-path representation of the field
-        self.rows = self.bounds.h/TILE_SIZE
-        self.cols = self.bounds.w/TILE_SIZE
-        end = xy2coord(self.exit.topleft) # will be changed later upon creep spawn
-        self.gridpath = GridPath(self.rows, self.cols, end)
-        
-    def get_next(self, coord):
-        return self.gridpath.get_next(coord)
     
-    def get_path(self, coord):
-        return self.gridpath._compute_path(coord)
-    
-    def block(self, coord):
-        self.gridpath.set_blocked(coord, True)
-        
-    def unblock(self, coord):
-        self.gridpath.set_blocked(coord, False)
-        
-    def is_blocked(self, coord):
-        return self.gridpath.map.is_blocked(coord)
-    
-    def draw(self, screen):
+    def draw(self, screen, buildable=None):
+        """ Draw the field, shading the 'buildable' positions if they
+            are shown (and known)
+        """
+        if self.show_buildable:
+            # clear the shading of the previous frame
+            screen.blit(self, self.bounds)
         self._draw_portals(screen)
+        if self.show_buildable and buildable is not None:
+            self._draw_buildable(screen, buildable)
         if self.show_grid:
             self._draw_grid(screen)
     
+    def _draw_buildable(self, screen, buildable):
+        buildable_sf = pygame.Surface((TILE_SIZE-1, TILE_SIZE-1))
+        buildable_sf.fill(pygame.color.Color(80, 200, 80))
+        buildable_sf.set_alpha(60)
+        for row, col in buildable:
+            screen.blit(buildable_sf, (self.bounds.left + col * TILE_SIZE,
+                                       self.bounds.top + row * TILE_SIZE))
+    
     def _draw_grid(self, screen):
         for y in range(self.rows+1):
             pygame.draw.line(screen, pygame.color.Color(50, 50, 50),
@@ -72,35 +60,32 @@ class Field(pygame.surface.Surface, GridPath):
                               self.bounds.bottom - 1))
     
     def _draw_portals(self, screen):
-        entrance_sf = pygame.Surface((self.entrance.w-1, self.entrance.h-1))
-        entrance_sf.fill(pygame.color.Color(80, 200, 80))
-        entrance_sf.set_alpha(150)
-        screen.blit(entrance_sf, self.entrance)
-        
-        exit_sf = pygame.Surface((self.exit.w-1, self.exit.h-1))
-        exit_sf.fill(pygame.color.Color(200, 80, 80))
-        exit_sf.set_alpha(150)
-        screen.blit(exit_sf, self.exit)
+        for entrance in self.entrances:
+            entrance_sf = pygame.Surface((entrance.w-1, entrance.h-1))
+            entrance_sf.fill(pygame.color.Color(80, 200, 80))
+            entrance_sf.set_alpha(150)
+            screen.blit(entrance_sf, entrance)
         
-    def _get_goal(self):
-        return self.gridpath.goal
-    
-    def _set_goal(self, coord):
-        self.gridpath.goal = coord
-        # path cahche invalid
-        self.gridpath._path_cache = {}
-        
-    goal = property(_get_goal, _set_goal, "The goal coordinates.")
+        for portal in self.exits:
+            exit_sf = pygame.Surface((portal.w-1, portal.h-1))
+            exit_sf.fill(pygame.color.Color(200, 80, 80))
+            exit_sf.set_alpha(150)
+            screen.blit(exit_sf, portal)
 
 
 class TowerDefence(object):
-    
-    def __init__(self):
+    """ The game window: draws an Engine, and plays it with the 
+        mouse and the keyboard.
+    """
+    def __init__(self, seed=None, armed_towers=False):
         # initialize screen
         pygame.init()
         title = "Tower Defence"
         version = "0.01"
-        self.screen_size = (FIELD_RECT.w,FIELD_RECT.h)
+        # the field, and a status line below it
+        self.status_rect = pygame.Rect(FIELD_RECT.left, FIELD_RECT.bottom,
+                                       FIELD_RECT.w, TILE_SIZE)
+        self.screen_size = (FIELD_RECT.w,FIELD_RECT.h+TILE_SIZE)
         self.screen = pygame.display.set_mode(self.screen_size)
         pygame.display.set_caption(title+" v"+version)
         icon = pygame.image.load("../img/icon.png")
@@ -120,186 +105,190 @@ class TowerDefence(object):
         self.clock = pygame.time.Clock()
         
         self.game_over = False
-        self.round_over = False
         self.paused = False
+        # show the pathfinding stats (toggled with i)
+        self.show_stats = False
 
+        # the sprites of the creeps of the swarm, by index
         self.creeps = pygame.sprite.Group()
+        self.creep_sprites = {}
+        self.creep_image = creep_image(TILE_SIZE, TILE_SIZE)
+        # the projectiles are all drawn with one image, in a batch
+        self.projectile_image = projectile_image()
+        self.projectile_rects = []
         self.towers = pygame.sprite.Group()
         self.player_towers = pygame.sprite.Group()
         # contains all sprites in this game
         self.sprites = pygame.sprite.RenderUpdates()
         
-        self._create_blocks()
-        
-        self.player = Player()
-        self.player.money = randint(5,20)
-        self.next = (0,0)
-        
-        self._create_random_towers()
-        
-        self.building_mode = False
-        self.build_time = 0
-        self.time = 0
         self.message_text = ""
         rect = pygame.Rect(self.field.bounds.left+1*self.tile_size, 
                                self.field.bounds.top+1*self.tile_size, 
                                2*self.tile_size, 2*self.tile_size)
         self.building_marker = Tower(rect, v(rect.topleft), 
                                      (255,255,200))
-        self.sprites.add(self.building_marker)
-        pygame.display.flip()
+        # the screen position of a tower the player is waiting for,
+        # until the engine knows if it can be built there
+        self.pending_build = None
         
-    def set_is_building(self, value):
-        if value:
-            self.build_time = 0
-            self.building_mode = True
+        # the game itself, simulated in fixed ticks whatever the frame 
+        # rate. The creeps' paths are computed in the background.
+        self.engine = Engine(seed, self.field, armed_towers=armed_towers)
+        self.stepper = FixedStep(TICK_TIME, self.engine.update, 
+                                 ready=self.engine.ready)
+        for coord in self.engine.blocks:
+            self._add_block(coord)
+        for position in self.engine.towers:
+            self.on_tower_built(position, 2, False)
+        if self.engine.is_building:
+            self.sprites.add(self.building_marker)
+        self.engine.add_observer(self)
+        pygame.display.flip()
+    
+    player = property(lambda self: self.engine.player)
+    build_time = property(lambda self: self.engine.build_time)
+    time = property(lambda self: self.engine.time)
+    round_over = property(lambda self: self.engine.round_over)
+    swarm = property(lambda self: self.engine.swarm)
+    
+    def _get_is_building(self):
+        return self.engine.is_building
+    
+    def _set_is_building(self, value):
+        self.engine.is_building = value
+    
+    is_building = property(_get_is_building, _set_is_building)
+    
+    def _add_block(self, coord):
+        rect = pygame.Rect(self.field.bounds.left+coord[1]*self.tile_size, 
+                           self.field.bounds.top+coord[0]*self.tile_size, 
+                           self.tile_size, self.tile_size)
+        block = Block(self.screen, rect, v(rect.topleft))
+        self.sprites.add(block)
+    
+    def on_tower_built(self, position, size, player):
+        row, col = position
+        rect = pygame.Rect(self.field.bounds.left+col*self.tile_size, 
+                           self.field.bounds.top+row*self.tile_size, 
+                           size*self.tile_size, size*self.tile_size)
+        if player:
+            color, group = (255,255,50), self.player_towers
+        else:
+            color, group = (255,200,50), self.towers
+        tower = Tower(rect, v(rect.topleft), color)
+        group.add(tower)
+        self.sprites.add(tower)
+    
+    def on_building_changed(self, building):
+        if building:
             self.sprites.add(self.building_marker)
         else:
-            self.build_time = 0
             self.sprites.remove(self.building_marker)
-            self.building_mode = False    
     
-    def get_is_building(self):
-        return self.building_mode
-        
-    is_building = property(get_is_building,set_is_building)
-        
-    def _create_blocks(self):
-        rows = self.field_size[1]/self.tile_size
-        cols = self.field_size[0]/self.tile_size
-        for x in range(1,9)+range(11,cols-1):
-            rect = pygame.Rect(self.field.bounds.left+x*self.tile_size, 
-                               self.field.bounds.top, 
-                               self.tile_size, self.tile_size)
-            block = Block(self.screen, rect, v(rect.topleft))
-            self.sprites.add(block)
-            coord = xy2coord((self.field.bounds.left+x*self.tile_size, 
-                              self.field.bounds.top))
-            self.field.block(coord)
-            rect = pygame.Rect(self.field.bounds.left+x*self.tile_size, 
-                               self.field.bounds.bottom-self.tile_size, 
-                               self.tile_size, self.tile_size)
-            block = Block(self.screen, rect, v(rect.topleft))
-            self.sprites.add(block)
-            coord = xy2coord((self.field.bounds.left+x*self.tile_size, 
-                                   self.field.bounds.bottom-self.tile_size))
-            self.field.block(coord)
-        for y in range(rows):
-            rect = pygame.Rect(self.field.bounds.left, 
-                               self.field.bounds.top+y*self.tile_size, 
-                               self.tile_size, self.tile_size)
-            block = Block(self.screen, rect, v(rect.topleft))
-            self.sprites.add(block)
-            coord = xy2coord((self.field.bounds.left, 
-                                   self.field.bounds.top+y*self.tile_size))
-            self.field.block(coord)
-            rect = pygame.Rect(self.field.bounds.right-self.tile_size, 
-                               self.field.bounds.top+y*self.tile_size, 
-                               self.tile_size, self.tile_size)
-            block = Block(self.screen, rect, v(rect.topleft))
-            self.sprites.add(block)
-            coord = xy2coord((self.field.bounds.right-self.tile_size, 
-                                   self.field.bounds.top+y*self.tile_size))
-            self.field.block(coord)
-            
-    def _create_random_towers(self):
-        tower_count = randint(6,15)
-        while len(self.towers) < tower_count:
-            row = randint(1,18)
-            col = randint(1,18)
-            self.build_tower(coord2xy_mid((row,col)),
-                             (255,200,50),
-                             self.towers)
-
-    def build_tower(self, pos, color, group):
-        row,col = xy2coord(pos)
-
-        #@todo: center tower over cursor?
-#        pos = pos[0]-self.tile_size/2,pos[1]-self.tile_size/2
-#        row,col = xy2coord(pos)
-
-        rect = pygame.Rect(self.field.bounds.left+col*self.tile_size, 
-                               self.field.bounds.top+row*self.tile_size, 
-                               2*self.tile_size, 2*self.tile_size)
+    def on_creep_spawned(self, index):
+        rect = pygame.Rect(0, 0, self.tile_size, self.tile_size)
+        creep = self.creep_sprites[index] = CreepSprite(self.creep_image, 
+                                                        rect)
+        self.creeps.add(creep)
+        self.sprites.add(creep)
+        self._sync_creeps()
+    
+    def on_creep_killed(self, index):
+        self.on_creep_finished(index)
+    
+    def on_creep_finished(self, index):
+        creep = self.creep_sprites.pop(index)
+        self.creeps.remove(creep)
+        self.sprites.remove(creep)
+#        lap_time = float(self.time)/1000.0
+#        print "Creep finished in",lap_time,"seconds"
+    
+    def _sync_creeps(self):
+        """ Move the creep sprites to the positions of their creeps
+            (to the nearest pixels)
+        """
+        pos = self.swarm.pos
+        for index, creep in self.creep_sprites.iteritems():
+            creep.rect.center = ((pos[index, 0] + SUBPIXELS / 2) // SUBPIXELS,
+                                 (pos[index, 1] + SUBPIXELS / 2) // SUBPIXELS)
+    
+    def _draw_projectiles(self):
+        """ Draw the projectiles. Returns the dirty rects: the ones 
+            drawn now and the ones of the previous frame.
+        """
+        projectiles = self.engine.projectiles
+        pos = projectiles.pos[projectiles.alive.nonzero()[0]]
+        offset = self.projectile_image.get_width() / 2
+        topleft = (pos + SUBPIXELS / 2) // SUBPIXELS - offset
+        image = self.projectile_image
+        rects = self.screen.blits([(image, xy) for xy in topleft.tolist()])
+        dirty = self.projectile_rects + rects
+        self.projectile_rects = rects
+        return dirty
+    
+    def build_tower(self, pos):
+        """ Build a tower of the player at the screen position 'pos'
+        """
+        return self.engine.build_tower(xy2coord(pos))
 
-        buildable, message = self._is_buildable(row,col)
-        if buildable:
-            tower = Tower(rect, v(rect.topleft), color)
-            group.add(tower)
-            self.sprites.add(tower)
-        return (buildable,message)
-            
-    def _is_buildable(self,row,col):
-        if self.player.money == 0:
-            self.is_building = False
-            return (False, "insufficient funds")
-        coords = []
-        for i in range(2):
-            for j in range(2):
-                coords.append(xy2coord((self.field.bounds.left+(col+i)*self.tile_size, 
-                                       self.field.bounds.top+(row+j)*self.tile_size)))
-                if self.field.is_blocked((row+i,col+j)):
-                    return (False, "invalid placement")
-        
-        for coord in coords:
-            self.field.block(coord)
-        start = xy2coord(self.field.entrance.topleft)
-        
-        # if no path is found; tower is blocking the creep path
-        if self.field.get_next(start) == None:
-            # unblock all tower coords
-            for coord in coords:
-                self.field.unblock(coord)
-            return (False, "blocking")
+    def _retry_build(self):
+        """ Try again to build the tower the player is waiting for
+        """
+        built, message = self.build_tower(self.pending_build)
+        if built is not None:
+            self.pending_build = None
+            self.message_text = message
 
-        return (True, "")
+    def _draw_building_marker(self, buildable):
+        """ Colour the building marker by whether a tower can be built
+            where it is, grey while that isn't known
+        """
+        coord = xy2coord(self.building_marker.rect.topleft)
+        if buildable is None:
+            self.building_marker.image.fill((200,200,200))
+        elif coord in buildable:
+            self.building_marker.image.fill((255,255,200))
+        else:
+            self.building_marker.image.fill((255,100,100))
+    
+    def spawn_creep(self, entrance_index=0, exit_index=None):
+        return self.engine.spawn_creep(entrance_index, exit_index)
 
-    def spawn_creep(self):
-        self.is_building = False
-        self.next = (0,0)
-        start = self._get_start_coord()
-        direction = (0,1)
-        speed = 2
-        bounds = pygame.Rect(start[0],
-                             start[1],
-                             self.tile_size,self.tile_size)
-        self.creep = Creep(start,bounds,direction,speed,self.field.get_next)
-        self.creeps.add(self.creep)
-        self.sprites.add(self.creep)
-        
-    def _get_start_coord(self):
-        start = (self.field.entrance.left+TILE_SIZE/2,
-                  self.field.entrance.top+TILE_SIZE/2)
-        row, col = xy2coord(start)
-        if self.field.is_blocked((row+1,col)):
-            start = (self.field.entrance.left+TILE_SIZE+TILE_SIZE/2,
-                     self.field.entrance.top+TILE_SIZE/2)
-        end = self.field.goal
-        row, col = end
-        if self.field.is_blocked((row-1,col)):
-            end = (self.field.entrance.left-TILE_SIZE+TILE_SIZE/2,
-                   self.field.entrance.top+TILE_SIZE/2)
-            self.field.goal = (row,col+1)
-        return start
+    def set_fast_forward(self, speed):
+        """ Simulate 'speed' ticks per tick of real time
+        """
+        self.stepper.speed = speed
 
     def pause(self):
         self.paused = not self.paused
         
     def restart(self):
+        self.engine.close()
         TowerDefence().run()
         self.quit()
 
     def quit(self):
+        self.engine.close()
         pygame.quit()
         exit()
 
     def draw(self):
         pygame.display.update()
+        self._sync_creeps()
         # clear
         self.sprites.clear(self.screen, self.field)
-        # draw
-        self.field.draw(self.screen)
+        self.screen.blits([(self.field, rect, rect) 
+                           for rect in self.projectile_rects], False)
+        # draw; the buildable positions are computed in the 
+        # background, so they may not be known yet
+        buildable = None
+        if self.is_building or self.field.show_buildable:
+            buildable = self.engine.buildable_positions()
+        if self.is_building:
+            self._draw_building_marker(buildable)
+        self.field.draw(self.screen, buildable)
         dirty = self.sprites.draw(self.screen)
+        dirty.extend(self._draw_projectiles())
         # print the player money
         font = pygame.font.Font(None, 20)
         money_text = font.render("$"+str(self.player.money), True, (255,255,0))
@@ -308,13 +297,16 @@ class TowerDefence(object):
         # print pause text if game is paused
         if self.paused:
             paused_text = font.render("||", True, (255,255,255))
+        elif self.stepper.speed > 1:
+            paused_text = font.render(">>x"+str(self.stepper.speed), True, 
+                                      (255,255,255))
         else:
             paused_text = font.render(">", True, (255,255,255))
         paused = self.screen.blit(paused_text, (3,3))
         dirty.append(paused)
         # print build time text
         if self.build_time > 0:
-            time_left = (45000-self.build_time)/1000.0
+            time_left = (BUILD_TIME-self.build_time)/1000.0
             time_text = font.render("s"+str(time_left), True, (255,255,255))
             time = self.screen.blit(time_text, (14*TILE_SIZE,3))
             dirty.append(time)
@@ -328,39 +320,30 @@ class TowerDefence(object):
         message_text = font.render(self.message_text, True, (255,50,50))
         message = self.screen.blit(message_text, (1*TILE_SIZE,3))
         dirty.append(message)
+        # print the pathfinding stats in the status line
+        rect = self.status_rect
+        self.screen.blit(self.background, rect, rect)
+        if self.show_stats:
+            stats = self.field.gridpath.stats()
+            stats_text = font.render(
+                "paths %d  expanded %d  max %.1fms  hits %d/%d" % (
+                    stats['queries'], stats['expansions'], 
+                    stats['max_query_time']*1000, stats['cache_hits'], 
+                    stats['cache_hits']+stats['cache_misses']), 
+                True, (200,200,255))
+            self.screen.blit(stats_text, (rect.left+3, rect.top+3))
+        dirty.append(rect)
         # update display
         pygame.display.update(dirty)
 
-    def update(self, time_passed):
-        if self.build_time < 45000 and self.is_building:
-            self.build_time += time_passed
-        elif self.time == 0 and not self.round_over:
-            self.time += time_passed
-            self.is_building = False
-            self.spawn_creep()
-        else:
-            self.time += time_passed
-
-#        # update all creeps positions
-        for creep in self.creeps:
-            if xy2coord(creep.pos) == self.field.goal:
-                self.creeps.remove(creep)
-                self.sprites.remove(creep)
-#                lap_time = float(self.time)/1000.0
-#                print "Creep finished in",lap_time,"seconds"
-                self.round_over = True
-            creep.update(time_passed)
-
     def run(self):
-        self.is_building = True
         while not self.game_over:
             # wating; 60 FPS
             time_passed = self.clock.tick(60)
-            # If too long has passed between two frames, don't update (the game 
-            # must have been suspended for some reason, and we don't want it to 
-            # "jump forward" suddenly)
-            if time_passed > 100:
-                continue
+            # The frames are simulated in fixed ticks, so the game runs 
+            # the same at any frame rate; after a long frame (e.g. the
+            # game was suspended), the stepper runs a few ticks at most
+            # instead of "jumping forward" suddenly.
             # handle user input
             for event in pygame.event.get():
                 if event.type == pygame.QUIT:
@@ -368,14 +351,11 @@ class TowerDefence(object):
                 elif event.type == pygame.MOUSEBUTTONDOWN and not self.paused:
                     # left click
                     if event.button == 1:
-                        built,message = self.build_tower(event.pos,
-                                                         (255,255,50),
-                                                         self.player_towers)
-                        if built:
-                            self.player.money -= 1
-                            self.message_text = ""
-                        else:
-                            self.message_text = message
+                        built,message = self.build_tower(event.pos)
+                        self.message_text = message
+                        self.pending_build = None
+                        if built is None:
+                            self.pending_build = event.pos
 #                    # right click
 #                    elif event.button == 3:
 #                        print xy2coord(event.pos)
@@ -401,11 +381,25 @@ class TowerDefence(object):
                         self.restart()
                     elif event.key == pygame.K_p or event.key == pygame.K_PAUSE:
                         self.pause()
+                    elif event.key == pygame.K_f:
+                        # fast-forward: x1, x2, x4, x8
+                        self.set_fast_forward(self.stepper.speed*2 % 15)
                     elif event.key == pygame.K_m:
                         self.field.gridpath.map.printme()
+                        if self.show_stats:
+                            print self.field.gridpath.stats()
+                    elif event.key == pygame.K_i:
+                        self.show_stats = not self.show_stats
+                        self.field.gridpath.enable_stats(self.show_stats)
+                        self.screen.blit(self.field, (0,0))
+                    elif event.key == pygame.K_b:
+                        self.field.show_buildable = not self.field.show_buildable
+                        self.screen.blit(self.field, (0,0))
+            if self.pending_build is not None and not self.paused:
+                self._retry_build()
             # update if not paused
             if not self.paused and not self.round_over:
-                self.update(time_passed)
+                self.stepper.advance(time_passed)
 #            if self.round_over:
 #                pygame.time.wait(10*1000)
 #                self.player_towers.empty()